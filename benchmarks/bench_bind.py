@@ -0,0 +1,63 @@
+"""
+Micro-benchmark: compiled Binder (row by row and column-wise) against bind.bind_params.
+Needs taospy and the TDengine client library, but no running server.
+
+    python benchmarks/bench_bind.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taostd.bind import Binder, bind_params, MULTI_BIND  # noqa: E402
+
+FIELDS = [
+    {'Field': 'ts', 'Type': 'TIMESTAMP', 'Note': ''},
+    {'Field': 'current', 'Type': 'FLOAT', 'Note': ''},
+    {'Field': 'voltage', 'Type': 'DOUBLE', 'Note': ''},
+    {'Field': 'phase', 'Type': 'INT', 'Note': ''},
+    {'Field': 'counter', 'Type': 'BIGINT', 'Note': ''},
+    {'Field': 'status', 'Type': 'TINYINT', 'Note': ''},
+    {'Field': 'online', 'Type': 'BOOL', 'Note': ''},
+    {'Field': 'remark', 'Type': 'NCHAR', 'Note': ''},
+    {'Field': 'location', 'Type': 'NCHAR', 'Note': 'TAG'},
+    {'Field': 'groupid', 'Type': 'TINYINT', 'Note': 'TAG'},
+]
+NUM_COLUMNS = 8
+TZ_OFFSET = 8
+
+ROWS = [
+    {"ts": datetime.now(), "current": 0.355, "voltage": 220.5, "phase": i % 3, "counter": i, "status": 1,
+     "online": True, "remark": "ok", "location": "北京", "groupid": 1}
+    for i in range(1000)
+]
+
+
+def run_bind_params():
+    for row in ROWS:
+        bind_params(NUM_COLUMNS, TZ_OFFSET, FIELDS, **row)
+
+
+def run_binder(binder):
+    bind = binder.bind
+    for row in ROWS:
+        bind(row)
+
+
+def run_bind_columns(binder):
+    binder.bind_columns(ROWS)
+
+
+if __name__ == '__main__':
+    binder = Binder(TZ_OFFSET, FIELDS)
+    repeat = 20
+    old = min(timeit.repeat(run_bind_params, number=1, repeat=repeat))
+    new = min(timeit.repeat(lambda: run_binder(binder), number=1, repeat=repeat))
+    print(f"rows per run: {len(ROWS)}, columns: {NUM_COLUMNS}")
+    print(f"bind_params : {old / len(ROWS) * 1e6:8.2f} us/row")
+    print(f"Binder.bind : {new / len(ROWS) * 1e6:8.2f} us/row  ({old / new:.2f}x)")
+    if MULTI_BIND:
+        columns = min(timeit.repeat(lambda: run_bind_columns(binder), number=1, repeat=repeat))
+        print(f"bind_columns: {columns / len(ROWS) * 1e6:8.2f} us/row  ({old / columns:.2f}x)")
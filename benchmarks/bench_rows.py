@@ -0,0 +1,43 @@
+"""
+Benchmark: memory per row and construction time of taostd.model.Dict against the compact taostd.model.Row.
+Runs without taospy.
+
+    python benchmarks/bench_rows.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taostd.model import Dict, row_class  # noqa: E402
+
+FIELDS = ['ts', 'current', 'voltage', 'phase', 'location', 'groupid']
+VALUES = [(datetime.now(), 0.355, 220.5, i % 3, '北京', 1) for i in range(100000)]
+
+
+def make_dict_rows():
+    return [Dict(FIELDS, x) for x in VALUES]
+
+
+def make_compact_rows():
+    make = row_class(tuple(FIELDS))._make
+    return [make(x) for x in VALUES]
+
+
+def memory_per_row(make_rows):
+    tracemalloc.start()
+    rows = make_rows()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(rows)
+
+
+if __name__ == '__main__':
+    repeat = 5
+    print(f"rows: {len(VALUES)}, fields: {len(FIELDS)}")
+    for name, make_rows in (('Dict', make_dict_rows), ('compact', make_compact_rows)):
+        seconds = min(timeit.repeat(make_rows, number=1, repeat=repeat))
+        print(f"{name:8s}: {memory_per_row(make_rows):7.1f} bytes/row, {seconds / len(VALUES) * 1e6:6.3f} us/row")
@@ -0,0 +1,191 @@
+"""
+Benchmark of the client-side overhead of taostd: rows/s and allocated bytes per row of the insert and select
+functions and of the metadata lookups, over row widths and batch sizes. Runs against the fake taos driver in
+benchmarks/fake, so neither taospy nor a server is needed.
+
+    python benchmarks/bench_td.py --output bench.json
+    python benchmarks/bench_td.py --quick --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake'))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import taos  # noqa: E402  the fake driver
+from taostd import td, cache  # noqa: E402
+
+WIDTHS = (4, 16, 64)
+BATCH_SIZES = (100, 1000)
+TABLES = 100
+# value column types, cycled over the width
+TYPES = (('DOUBLE', 8), ('INT', 4), ('BIGINT', 8), ('FLOAT', 4), ('NCHAR', 16), ('BOOL', 1))
+TAGS = [('location', 'NCHAR', 20, 'TAG'), ('groupid', 'INT', 4, 'TAG')]
+
+
+def make_stable(width):
+    stable = f"w{width}"
+    fields = [('ts', 'TIMESTAMP', 8, '')]
+    for i in range(width - 1):
+        field_type, length = TYPES[i % len(TYPES)]
+        fields.append((f"c{i}", field_type, length, ''))
+    taos.SERVER.add_stable(stable, fields + TAGS)
+    for i in range(TABLES):
+        taos.SERVER.tables[f"{stable}_{i}"] = stable
+    return stable, fields
+
+
+def make_rows(fields, count, start=1640966400000):
+    samples = {'DOUBLE': 220.5, 'INT': 3, 'BIGINT': 1 << 40, 'FLOAT': 0.355, 'NCHAR': '北京', 'BOOL': True}
+    rows = []
+    for n in range(count):
+        row = {'ts': start + n}
+        for name, field_type, _, _ in fields[1:]:
+            row[name] = samples[field_type]
+        row['location'] = '上海'
+        row['groupid'] = 1
+        rows.append(row)
+    return rows
+
+
+def scenarios(width, batch_size, count):
+    """
+    yield (name, batch_size, rows, run), run() does the work once and returns the rows it handled
+    """
+    stable, fields = make_stable(width)
+    rows = make_rows(fields, count)
+    table = f"{stable}_0"
+    tables_rows = [dict(row, table=f"{stable}_{n % TABLES}") for n, row in enumerate(rows)]
+    new_tables = iter(range(1 << 30))
+
+    if batch_size == BATCH_SIZES[0]:
+        def insert_one():
+            for row in rows:
+                td.insert_one(table, **row)
+            return len(rows)
+
+        yield 'insert_one', 1, len(rows), insert_one
+
+        def select():
+            taos.SERVER.select_fields = [f[0] for f in fields]
+            taos.SERVER.select_rows = [tuple(row[f[0]] for f in fields) for row in rows]
+            return len(td.select(f"select * from {table}"))
+
+        yield 'select', None, len(rows), select
+
+        def select_compact():
+            return len(td.select(f"select * from {table}", row_type='compact'))
+
+        yield 'select_compact', None, len(rows), select_compact
+
+        def meta_lookup():
+            names = [f"{stable}_{n}" for n in range(TABLES)]
+            with td.connection():
+                for name in names:
+                    cache.delete(name)
+                    td._get_table_cache(name)
+            return len(names)
+
+        yield 'meta_lookup', 1, TABLES, meta_lookup
+
+        def meta_lookup_batch():
+            args = [{'table': f"{stable}_{n}", 'stable': stable} for n in range(TABLES)]
+            with td.connection():
+                for arg in args:
+                    cache.delete(arg['table'])
+                td._get_tables_cache(args)
+            return len(args)
+
+        yield 'meta_lookup_batch', TABLES, TABLES, meta_lookup_batch
+
+    def insert_many():
+        return td.insert_many(table, rows, batch_size=batch_size)
+
+    yield 'insert_many', batch_size, len(rows), insert_many
+
+    def insert_many_with_stable():
+        return td.insert_many_with_stable(f"{stable}_new_{next(new_tables)}", stable, rows, batch_size=batch_size)
+
+    yield 'insert_many_with_stable', batch_size, len(rows), insert_many_with_stable
+
+    def insert_many_tables():
+        return td.insert_many_tables(tables_rows, batch_size=batch_size)
+
+    yield 'insert_many_tables', batch_size, len(rows), insert_many_tables
+
+
+def measure(run, repeat):
+    run()  # warm up the caches
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handled = run()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return handled, best, peak
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r['name'], r['width'], r['batch_size']): r for r in json.load(f)['results']}
+    print(f"\ncompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get((r['name'], r['width'], r['batch_size']))
+        if old:
+            ratio = r['rows_per_sec'] / old['rows_per_sec']
+            print(f"{r['name']:24s} width {r['width']:3d} batch {str(r['batch_size']):5s} {ratio:6.2f}x rows/s, "
+                  f"{r['peak_bytes_per_row'] - old['peak_bytes_per_row']:+9.1f} bytes/row")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='rows of each scenario')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each scenario, the best one is kept')
+    parser.add_argument('--quick', action='store_true', help='1000 rows and 2 runs')
+    parser.add_argument('--output', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+    options = parser.parse_args()
+    if options.quick:
+        options.rows, options.repeat = 1000, 2
+
+    td.init_db('bench', warmup='lazy')
+    results = []
+    for width in WIDTHS:
+        for batch_size in BATCH_SIZES:
+            for name, batch, count, run in scenarios(width, batch_size, options.rows):
+                handled, seconds, peak = measure(run, options.repeat)
+                result = {'name': name, 'width': width, 'batch_size': batch, 'rows': handled, 'seconds': seconds,
+                          'rows_per_sec': handled / seconds, 'peak_bytes_per_row': peak / count}
+                results.append(result)
+                print(f"{name:24s} width {width:3d} batch {str(batch):5s} {result['rows_per_sec']:12.0f} rows/s "
+                      f"{result['peak_bytes_per_row']:9.1f} bytes/row")
+
+    report = {'version': version(), 'python': platform.python_version(), 'time': datetime.now().isoformat(),
+              'rows': options.rows, 'repeat': options.repeat, 'results': results}
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+In-process stand-in of taospy for the benchmarks: connections, cursors, statements and results that record the
+calls in SERVER and keep only the table -> stable map, so that what is measured is the overhead of taostd.
+Binding stores the values as they are, the conversion to C buffers done by taospy is not measured.
+"""
+import re
+from collections import Counter
+from taos import error
+
+TABLE_NOT_EXIST = -2147482782
+
+
+class SmlProtocol:
+    UNKNOWN_PROTOCOL = 0
+    LINE_PROTOCOL = 1
+    TELNET_PROTOCOL = 2
+    JSON_PROTOCOL = 3
+
+
+class SmlPrecision:
+    NOT_CONFIGURED = 0
+    HOURS = 1
+    MINUTES = 2
+    SECONDS = 3
+    MILLI_SECONDS = 4
+    MICRO_SECONDS = 5
+    NANO_SECONDS = 6
+
+
+class Server(object):
+    """
+    State shared by all the fake connections.
+    """
+
+    def __init__(self):
+        self.stables = {}  # stable -> [(field, type, length, note)]
+        self.tables = {}  # table -> stable
+        self.tags = {}  # table -> tag values bound by set_tbname_tags
+        self.rows = 0
+        self.calls = Counter()
+        self.select_fields = ['v']
+        self.select_rows = [(1,)]
+
+    def add_stable(self, name, fields):
+        self.stables[name] = fields
+
+    def reset(self):
+        self.__init__()
+
+
+SERVER = Server()
+
+
+class TaosResult(object):
+
+    def __init__(self, fields=(), rows=(), affected_rows=0):
+        self.fields = [{'name': name} for name in fields]
+        self.rows = rows
+        self.affected_rows = affected_rows
+        self.precision = 0
+        self._fetched = False
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def next(self):
+        if not self.rows:
+            raise StopIteration
+        return self.rows[0]
+
+    def fetch_block(self):
+        if self._fetched or not self.rows:
+            raise StopIteration
+        self._fetched = True
+        return self.rows, len(self.rows)
+
+    def close(self):
+        pass
+
+
+class TaosBind(object):
+    __slots__ = ('value',)
+
+    def null(self):
+        self.value = None
+
+
+class TaosMultiBind(object):
+
+    def __init__(self):
+        self.buffer_type = None
+        self.buffer = None
+        self.buffer_length = 0
+        self.length = None
+        self.is_null = None
+        self.num = 0
+
+
+def _bind_method(name):
+    def bind(self, value):
+        self.value = value
+
+    bind.__name__ = name
+    return bind
+
+
+def _multi_bind_method(name):
+    def bind(self, values):
+        self.buffer = values
+        self.num = len(values)
+
+    bind.__name__ = name
+    return bind
+
+
+for _name in ('timestamp', 'bool', 'tinyint', 'tinyint_unsigned', 'smallint', 'smallint_unsigned', 'int',
+              'int_unsigned', 'bigint', 'bigint_unsigned', 'float', 'double', 'binary', 'nchar', 'json'):
+    setattr(TaosBind, _name, _bind_method(_name))
+    setattr(TaosMultiBind, _name, _multi_bind_method(_name))
+
+
+def new_bind_params(size):
+    return [TaosBind() for _ in range(size)]
+
+
+def new_multi_binds(size):
+    return [TaosMultiBind() for _ in range(size)]
+
+
+class TaosStmt(object):
+
+    def __init__(self, sql):
+        SERVER.calls['prepare'] += 1
+        m = re.match(r"INSERT INTO (\S+)(?: USING (\w+))?", sql, re.I)
+        self.table = m.group(1)
+        self.using = m.group(2)
+        self.pending = []
+        self.affected_rows = 0
+
+    def set_tbname(self, name):
+        self.table = name
+
+    def set_tbname_tags(self, name, tags):
+        self.table = name
+        SERVER.tags[name] = [getattr(tag, 'value', None) for tag in tags]
+
+    def bind_param(self, params, add_batch=True):
+        self.pending.append((self.table, 1))
+
+    def bind_param_batch(self, binds, add_batch=True):
+        self.pending.append((self.table, binds[0].num))
+
+    def execute(self):
+        SERVER.calls['execute'] += 1
+        pending, self.pending = self.pending, []
+        self.affected_rows = 0
+        for table, rows in pending:
+            if table not in SERVER.tables:
+                if not self.using:
+                    raise error.StatementError("Table does not exist", TABLE_NOT_EXIST)
+                SERVER.tables[table] = self.using
+            self.affected_rows += rows
+        SERVER.rows += self.affected_rows
+
+    def use_result(self):
+        return TaosResult(affected_rows=self.affected_rows)
+
+    def close(self):
+        pass
+
+
+class TaosCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql):
+        return self.connection.query(sql).affected_rows
+
+    def close(self):
+        pass
+
+
+_SHOW_STABLES = re.compile(r"show stables(?: like '(.*)')?$", re.I)
+_DESCRIBE = re.compile(r"describe (\w+)$", re.I)
+_SHOW_TABLES = re.compile(r"show tables(?: like '(.*)')?$", re.I)
+_TBNAMES = re.compile(r"select tbname from (\w+)(?: where tbname in \((.*)\))?(?: limit (\d+) offset (\d+))?$", re.I)
+_USING = re.compile(r"(\w+) USING (\w+) TAGS")
+_INSERT_TABLE = re.compile(r"(\w+)(?: USING \w+ TAGS\(.*?\))? VALUES")
+
+
+class TaosConnection(object):
+
+    def __init__(self, *args, **kwargs):
+        SERVER.calls['connect'] += 1
+
+    def cursor(self):
+        return TaosCursor(self)
+
+    def statement(self, sql=None):
+        return TaosStmt(sql)
+
+    def schemaless_insert(self, lines, protocol, precision):
+        SERVER.calls['schemaless_insert'] += 1
+        SERVER.rows += len(lines)
+        return len(lines)
+
+    def query(self, sql):
+        SERVER.calls['query'] += 1
+        sql = sql.strip()
+        if sql[:6].upper() == 'INSERT':
+            return self._insert(sql)
+
+        m = _SHOW_STABLES.match(sql)
+        if m:
+            names = [name for name in SERVER.stables if m.group(1) in (None, name)]
+            return TaosResult(['name', 'columns', 'tags'],
+                              [(name, sum(f[3] == '' for f in SERVER.stables[name]),
+                                sum(f[3] == 'TAG' for f in SERVER.stables[name])) for name in names])
+        m = _DESCRIBE.match(sql)
+        if m:
+            return TaosResult(['Field', 'Type', 'Length', 'Note'], SERVER.stables[m.group(1)])
+        m = _SHOW_TABLES.match(sql)
+        if m:
+            return TaosResult(['table_name', 'stable_name'],
+                              [(name, stable) for name, stable in SERVER.tables.items() if m.group(1) in (None, name)])
+        m = _TBNAMES.match(sql)
+        if m:
+            names = [name for name, stable in SERVER.tables.items() if stable == m.group(1)]
+            if m.group(2):
+                wanted = {name.strip().strip("'") for name in m.group(2).split(',')}
+                names = [name for name in names if name in wanted]
+            if m.group(3):
+                offset = int(m.group(4))
+                names = names[offset:offset + int(m.group(3))]
+            return TaosResult(['tbname'], [(name,) for name in names])
+        return TaosResult(SERVER.select_fields, SERVER.select_rows)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _insert(sql):
+        for table, stable in _USING.findall(sql):
+            SERVER.tables.setdefault(table, stable)
+        for table in _INSERT_TABLE.findall(sql):
+            if table not in SERVER.tables:
+                raise error.ProgrammingError("Table does not exist", TABLE_NOT_EXIST)
+        rows = sql.count(' VALUES (')
+        SERVER.rows += rows
+        return TaosResult(affected_rows=rows)
+
+
+def connect(*args, **kwargs):
+    return TaosConnection(*args, **kwargs)
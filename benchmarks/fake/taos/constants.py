@@ -0,0 +1,17 @@
+class FieldType(object):
+    C_NULL = 0
+    C_BOOL = 1
+    C_TINYINT = 2
+    C_SMALLINT = 3
+    C_INT = 4
+    C_BIGINT = 5
+    C_FLOAT = 6
+    C_DOUBLE = 7
+    C_BINARY = 8
+    C_TIMESTAMP = 9
+    C_NCHAR = 10
+    C_TINYINT_UNSIGNED = 11
+    C_SMALLINT_UNSIGNED = 12
+    C_INT_UNSIGNED = 13
+    C_BIGINT_UNSIGNED = 14
+    C_JSON = 15
@@ -0,0 +1,27 @@
+"""
+Errors of the fake driver, with the errno and msg attributes of taospy.
+"""
+
+
+class Error(Exception):
+
+    def __init__(self, msg=None, errno=0xffff):
+        self.msg = msg
+        self.errno = errno
+        super().__init__(f"[0x{errno & 0xffff:04x}]: {msg}")
+
+
+class ConnectionError(Error):
+    pass
+
+
+class ProgrammingError(Error):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+class StatementError(Error):
+    pass
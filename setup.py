@@ -18,6 +18,9 @@ setup(
     author='summry',
     author_email='xiazhongbiao@126.com',
     keywords=['sql', 'taos', 'TDengine', 'Time Series Database', 'python'],
+    extras_require={
+        'numpy': ['numpy>=1.17'],
+    },
     tests_require=[
         'pandas'
     ],
@@ -0,0 +1,233 @@
+"""
+asyncio API of taostd. The blocking calls of td run on a bounded set of single-thread executors, each call checks out
+a connection of the pool of td and releases it when it returns, so the synchronous td functions share the pool.
+    from taostd import aio
+    await aio.init_db(database="test", pool_size=4)
+    await aio.insert_one('meter_01', ts=datetime.now(), current=0.3550, voltage=0.5542, phase=1)
+    rows = await aio.select("select * from meters")
+    async with aio.connection() as conn:
+        async for row in conn.iter_select("select * from meters"):
+            ...
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from taostd import td
+from taostd.model import TDError, ConnectionCtx
+
+# idle AsyncConnection objects
+_connections = None
+_all_connections = []
+# returned by next() in the executor at the end of a generator, StopIteration cannot cross a future
+_END = object()
+
+
+class AsyncConnection(object):
+    """
+    A single-thread executor, the calls run on it one at a time.
+    """
+
+    def __init__(self, name):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        run func(*args, **kwargs) in the thread of the connection.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(_call, func, *args, **kwargs))
+
+    async def execute(self, sql: str, params=None) -> int:
+        return await self.run(td.execute, sql, params)
+
+    async def get(self, sql: str, ttl=None):
+        return await self.run(td.get, sql, ttl)
+
+    async def select_one(self, sql: str, row_type=None, ttl=None):
+        return await self.run(td.select_one, sql, row_type, ttl)
+
+    async def select(self, sql: str, row_type=None, ttl=None):
+        return await self.run(td.select, sql, row_type, ttl)
+
+    async def select_columns(self, sql: str, as_numpy=False, datetime64=False):
+        return await self.run(td.select_columns, sql, as_numpy, datetime64)
+
+    async def iter_select(self, sql: str, chunk_size=None, row_type=None):
+        """
+        async generator of td.iter_select, the blocks are fetched in the thread of the connection.
+        """
+        async for item in self._iterate(td.iter_select, sql, chunk_size, row_type):
+            yield item
+
+    async def iter_select_columns(self, sql: str, as_numpy=False, datetime64=False):
+        async for item in self._iterate(td.iter_select_columns, sql, as_numpy, datetime64):
+            yield item
+
+    async def insert_one(self, table: str, **kwargs):
+        return await self.run(td.insert_one, table, **kwargs)
+
+    async def insert_one_with_stable(self, table: str, stable: str, **kwargs):
+        return await self.run(td.insert_one_with_stable, table, stable, **kwargs)
+
+    async def insert_many(self, table: str, args: list, batch_size=100):
+        return await self.run(td.insert_many, table, args, batch_size)
+
+    async def insert_many_with_stable(self, table: str, stable: str, args: list, batch_size=100):
+        return await self.run(td.insert_many_with_stable, table, stable, args, batch_size)
+
+    async def insert_many_tables(self, args: list, batch_size=100):
+        return await self.run(td.insert_many_tables, args, batch_size)
+
+    async def insert_dataframe(self, table: str, df, stable: str = None, tag_columns=None, batch_size=1000):
+        return await self.run(td.insert_dataframe, table, df, stable, tag_columns, batch_size)
+
+    async def drop_table(self, table: str):
+        return await self.run(td.drop_table, table)
+
+    async def close(self):
+        self.executor.shutdown()
+
+    async def _iterate(self, func, *args):
+        items = await self.run(func, *args)
+        try:
+            while True:
+                item = await self.run(next, items, _END)
+                if item is _END:
+                    return
+                yield item
+        finally:
+            await self.run(items.close)
+
+
+class _ConnectionCtx(object):
+
+    async def __aenter__(self):
+        if _connections is None:
+            raise TDError('DB is not initialized.')
+        self.connection = await _connections.get()
+        return self.connection
+
+    async def __aexit__(self, exctype, excvalue, traceback):
+        _connections.put_nowait(self.connection)
+
+
+async def init_db(database, pool_size=1, tz_offset=8, *args, **kwargs):
+    """
+    init td in a thread and pool_size AsyncConnection. The parameters are the ones of td.init_db,
+    max_pool_size is at least pool_size.
+    """
+    global _connections
+    if _connections is not None:
+        raise TDError('DB is already initialized.')
+    kwargs['max_pool_size'] = max(kwargs.get('max_pool_size') or pool_size, pool_size)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, functools.partial(td.init_db, database, pool_size, tz_offset, *args, **kwargs))
+    _connections = asyncio.Queue()
+    for i in range(pool_size):
+        conn = AsyncConnection(f'taostd-aio-{i}')
+        _all_connections.append(conn)
+        _connections.put_nowait(conn)
+
+
+async def close():
+    """
+    stop the threads of the AsyncConnection objects. The connection pool of td stays open, the synchronous td
+    functions can still be used after it.
+    """
+    global _connections
+    for conn in _all_connections:
+        await conn.close()
+    _all_connections.clear()
+    _connections = None
+
+
+def connection():
+    """
+    Return an async context manager that checks out an AsyncConnection, so that several calls run one after the
+    other in its thread:
+    async with aio.connection() as conn:
+        await conn.insert_one(...)
+        await conn.select(...)
+    """
+    return _ConnectionCtx()
+
+
+async def execute(sql: str, params=None) -> int:
+    async with connection() as conn:
+        return await conn.execute(sql, params)
+
+
+async def get(sql: str, ttl=None):
+    async with connection() as conn:
+        return await conn.get(sql, ttl)
+
+
+async def select_one(sql: str, row_type=None, ttl=None):
+    async with connection() as conn:
+        return await conn.select_one(sql, row_type, ttl)
+
+
+async def select(sql: str, row_type=None, ttl=None):
+    async with connection() as conn:
+        return await conn.select(sql, row_type, ttl)
+
+
+async def select_columns(sql: str, as_numpy=False, datetime64=False):
+    async with connection() as conn:
+        return await conn.select_columns(sql, as_numpy, datetime64)
+
+
+async def iter_select(sql: str, chunk_size=None, row_type=None):
+    async with connection() as conn:
+        async for item in conn.iter_select(sql, chunk_size, row_type):
+            yield item
+
+
+async def iter_select_columns(sql: str, as_numpy=False, datetime64=False):
+    async with connection() as conn:
+        async for item in conn.iter_select_columns(sql, as_numpy, datetime64):
+            yield item
+
+
+async def insert_one(table: str, **kwargs):
+    async with connection() as conn:
+        return await conn.insert_one(table, **kwargs)
+
+
+async def insert_one_with_stable(table: str, stable: str, **kwargs):
+    async with connection() as conn:
+        return await conn.insert_one_with_stable(table, stable, **kwargs)
+
+
+async def insert_many(table: str, args: list, batch_size=100):
+    async with connection() as conn:
+        return await conn.insert_many(table, args, batch_size)
+
+
+async def insert_many_with_stable(table: str, stable: str, args: list, batch_size=100):
+    async with connection() as conn:
+        return await conn.insert_many_with_stable(table, stable, args, batch_size)
+
+
+async def insert_many_tables(args: list, batch_size=100):
+    async with connection() as conn:
+        return await conn.insert_many_tables(args, batch_size)
+
+
+async def insert_dataframe(table: str, df, stable: str = None, tag_columns=None, batch_size=1000):
+    async with connection() as conn:
+        return await conn.insert_dataframe(table, df, stable, tag_columns, batch_size)
+
+
+async def drop_table(table: str):
+    async with connection() as conn:
+        return await conn.drop_table(table)
+
+
+def _call(func, *args, **kwargs):
+    """
+    run in the thread of an AsyncConnection: a pooled connection is checked out for the call and released when it
+    returns, as broken when the call fails on it.
+    """
+    with ConnectionCtx(td._db_ctx):
+        return func(*args, **kwargs)
@@ -1,5 +1,11 @@
 import taos
-from datetime import datetime, timezone, timedelta
+from ctypes import c_int64
+from taostd import metrics
+from taostd.model import TDError
+from datetime import datetime, date, timezone, timedelta
+
+# taospy binds a whole batch column by column when it has the multi-bind API
+MULTI_BIND = hasattr(taos, 'new_multi_binds') and hasattr(getattr(taos, 'TaosStmt', None), 'bind_param_batch')
 
 
 def bind_params(num_columns: int, tz_offset, fields: list, **kwargs):
@@ -11,10 +17,7 @@ def bind_params(num_columns: int, tz_offset, fields: list, **kwargs):
             if param is None:
                 params[i].null()
             elif f['Type'] == 'TIMESTAMP':
-                if isinstance(param, str):
-                    param = str2time(param)
-                param -= timedelta(hours=tz_offset)
-                params[i].timestamp(param)
+                params[i].timestamp(to_epoch(param, _offset_ms(tz_offset)))
             elif f['Type'] == 'INT':
                 params[i].int(param)
             elif f['Type'] == 'INT UNSIGNED':
@@ -46,6 +49,142 @@ def bind_params(num_columns: int, tz_offset, fields: list, **kwargs):
     return params
 
 
+class Binder(object):
+    """
+    Bind plan compiled once per stable: the value columns of the stable and a setter for each of them,
+    so that binding a row is a single loop without any type dispatch. With note='TAG' it binds the tags.
+    """
+
+    def __init__(self, tz_offset, fields: list, note=""):
+        self.indexes = [i for i, f in enumerate(fields) if f['Note'] == note]
+        self.names = [fields[i]['Field'] for i in self.indexes]
+        self.setters = [_compile_setter(fields[i]['Type'], tz_offset) for i in self.indexes]
+        self.num_columns = len(self.indexes)
+        self._plan = list(zip(range(self.num_columns), self.names, self.setters))
+        if MULTI_BIND:
+            column_setters = [_compile_column_setter(fields[i]['Type'], tz_offset) for i in self.indexes]
+            self._column_plan = list(zip(range(self.num_columns), self.names, column_setters))
+
+    def bind(self, kwargs: dict):
+        start = metrics.start()
+        params = self._bind(kwargs)
+        metrics.timing('bind', start, 1)
+        return params
+
+    def _bind(self, kwargs: dict):
+        params = taos.new_bind_params(self.num_columns)
+        get = kwargs.get
+        for i, name, setter in self._plan:
+            param = get(name)
+            if param is None and name not in kwargs:
+                param = lookup(kwargs, name)
+            if param is None:
+                params[i].null()
+            else:
+                setter(params[i], param)
+        return params
+
+    def has_values(self, kwargs: dict):
+        """
+        whether kwargs holds a value of one of the fields, the tags of a table to create
+        """
+        return any(lookup(kwargs, name) is not None for name in self.names)
+
+    def batch_bind(self, args: list):
+        start = metrics.start()
+        bind = self._bind
+        params = [bind(arg) for arg in args]
+        metrics.timing('bind', start, len(args))
+        return params
+
+    def bind_columns(self, args: list):
+        """
+        Transpose rows into one column per field and bind the whole batch with a single TaosMultiBind array.
+        """
+        start = metrics.start()
+        binds = taos.new_multi_binds(self.num_columns)
+        for i, name, setter in self._column_plan:
+            values = [arg.get(name) for arg in args]
+            if None in values:
+                values = [lookup(arg, name) if v is None else v for v, arg in zip(values, args)]
+            setter(binds[i], values)
+        metrics.timing('bind_columns', start, len(args))
+        return binds
+
+
+def lookup(arg: dict, name: str):
+    """
+    value of the field name in arg, the lower-case name of the stable, matched case-insensitively when arg has
+    no key name.
+    """
+    value = arg.get(name)
+    if value is None and name not in arg:
+        for key, v in arg.items():
+            if isinstance(key, str) and key.lower() == name:
+                return v
+    return value
+
+
+# TaosBind method for each field type
+_BIND_METHODS = {
+    'INT': 'int',
+    'INT UNSIGNED': 'int_unsigned',
+    'BIGINT': 'bigint',
+    'BIGINT UNSIGNED': 'bigint_unsigned',
+    'FLOAT': 'float',
+    'DOUBLE': 'double',
+    'BINARY': 'binary',
+    'SMALLINT': 'smallint',
+    'SMALLINT UNSIGNED': 'smallint_unsigned',
+    'TINYINT': 'tinyint',
+    'TINYINT UNSIGNED': 'tinyint_unsigned',
+    'BOOL': 'bool',
+    'NCHAR': 'nchar',
+    'JSON': 'json',
+}
+
+
+def _compile_setter(field_type: str, tz_offset):
+    if field_type == 'TIMESTAMP':
+        offset_ms = _offset_ms(tz_offset)
+
+        def set_timestamp(param, value):
+            param.timestamp(to_epoch(value, offset_ms))
+
+        return set_timestamp
+
+    method = _BIND_METHODS.get(field_type)
+    if method is None:
+        raise TDError(f"Unsupported field type '{field_type}'.")
+    return getattr(taos.TaosBind, method)
+
+
+def _compile_column_setter(field_type: str, tz_offset):
+    if field_type == 'TIMESTAMP':
+        offset_ms = _offset_ms(tz_offset)
+
+        def set_timestamps(binds, values):
+            epochs = [_BIGINT_NULL if v is None else to_epoch(v, offset_ms) for v in values]
+            binds.timestamp((c_int64 * len(epochs))(*epochs))
+
+        return set_timestamps
+
+    method = _BIND_METHODS.get(field_type)
+    if method is None:
+        raise TDError(f"Unsupported field type '{field_type}'.")
+    set_values = getattr(taos.TaosMultiBind, method)
+    if field_type in ('BINARY', 'NCHAR'):
+        # the multi-bind setters take str only, bytes are accepted row by row
+
+        def set_strings(binds, values):
+            if any(isinstance(v, bytes) for v in values):
+                values = [v.decode('utf-8') if isinstance(v, bytes) else v for v in values]
+            set_values(binds, values)
+
+        return set_strings
+    return set_values
+
+
 def batch_bind_params(num_columns: int, tz_offset, fields: list, args: list):
     params = []
     for arg in args:
@@ -53,17 +192,106 @@ def batch_bind_params(num_columns: int, tz_offset, fields: list, args: list):
     return params
 
 
-def str2time(t_str: str):
+# NULL of TIMESTAMP in a TaosMultiBind buffer
+_BIGINT_NULL = -9223372036854775808
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# epoch milliseconds of 'YYYY-MM-DD' prefixes already parsed
+_day_epochs = {}
+_DAY_EPOCHS_SIZE = 4096
+
+
+def _offset_ms(tz_offset):
+    return int(round(tz_offset * 3600000))
+
+
+def to_epoch(value, offset_ms: int):
+    """
+    Epoch of a TIMESTAMP value, computed with integers only.
+    str and naive datetime are local time, shifted to UTC by offset_ms, the result is in milliseconds.
+    Time zone aware datetime and str ending with Z or +HH:MM are converted with their own offset. int is an epoch in the precision of the database
+    (ms, us or ns) and passed straight through, float is epoch seconds.
+    """
+    if isinstance(value, str):
+        value, str_offset_ms = _split_utc_offset(value)
+        return str2epoch(value) - (offset_ms if str_offset_ms is None else str_offset_ms)
+    elif isinstance(value, datetime):
+        if value.tzinfo is not None:
+            utcoffset = value.utcoffset()
+            offset_ms = (utcoffset.days * 86400 + utcoffset.seconds) * 1000 + utcoffset.microseconds // 1000
+        seconds = (value.toordinal() - _EPOCH_ORDINAL) * 86400 + value.hour * 3600 + value.minute * 60 + value.second
+        return seconds * 1000 + (value.microsecond + 500) // 1000 - offset_ms
+    elif isinstance(value, int) and not isinstance(value, bool):
+        return value
+    elif isinstance(value, float):
+        return int(round(value * 1000))
+    raise TDError(f"Invalid timestamp {value!r}.")
+
+
+def _split_utc_offset(t_str: str):
+    """
+    (t_str without its UTC offset, offset in milliseconds) of 'YYYY-MM-DD HH:MM:SS+HH:MM', +HHMM, +HH or Z,
+    the offset is None when t_str has none.
+    """
+    if t_str[-1:] in ('Z', 'z'):
+        return t_str[:-1], 0
+    i = max(t_str.rfind('+'), t_str.rfind('-'))
+    if i <= 10:  # the '-' of the day part
+        return t_str, None
+    offset = t_str[i + 1:].replace(':', '')
+    if len(offset) not in (2, 4) or not offset.isdigit():
+        raise KeyError("Invalid time format.")
+    offset_ms = int(offset[:2]) * 3600000 + int(offset[2:] or 0) * 60000
+    return t_str[:i], -offset_ms if t_str[i] == '-' else offset_ms
+
+
+def str2epoch(t_str: str):
+    """
+    Epoch milliseconds of 'YYYY-MM-DD[ HH[:MM[:SS[.ffffff]]]]', read as UTC. The day part is memoized.
+    """
     str_len = len(t_str)
-    if str_len == 10:
-        return datetime.strptime(t_str, "%Y-%m-%d")
-    elif str_len == 13:
-        return datetime.strptime(t_str, "%Y-%m-%d %H")
-    elif str_len == 16:
-        return datetime.strptime(t_str, "%Y-%m-%d %H:%M")
-    elif str_len == 19:
-        return datetime.strptime(t_str, "%Y-%m-%d %H:%M:%S")
-    elif 21 <= str_len <= 26:
-        return datetime.strptime(t_str, "%Y-%m-%d %H:%M:%S.%f")
-    else:
-        raise KeyError("Invalid time format.")
\ No newline at end of file
+    if not (str_len in (10, 13, 16, 19) or 21 <= str_len <= 26):
+        raise KeyError("Invalid time format.")
+
+    day = t_str[:10]
+    epoch = _day_epochs.get(day)
+    if epoch is None:
+        epoch = (date(int(day[:4]), int(day[5:7]), int(day[8:10])).toordinal() - _EPOCH_ORDINAL) * 86400000
+        if len(_day_epochs) >= _DAY_EPOCHS_SIZE:
+            _day_epochs.clear()
+        _day_epochs[day] = epoch
+
+    if str_len > 10:
+        epoch += int(t_str[11:13]) * 3600000
+    if str_len > 13:
+        epoch += int(t_str[14:16]) * 60000
+    if str_len > 16:
+        epoch += int(t_str[17:19]) * 1000
+    if str_len > 20:
+        epoch += (int(t_str[20:].ljust(6, '0')) + 500) // 1000
+    return epoch
+
+
+def str2time(t_str: str):
+    """
+    datetime of 'YYYY-MM-DD[ HH[:MM[:SS[.ffffff]]]]', time zone aware when t_str ends with Z or +HH:MM.
+    """
+    t_str, offset_ms = _split_utc_offset(t_str)
+    try:
+        value = datetime.fromisoformat(t_str)
+    except (AttributeError, ValueError):
+        str_len = len(t_str)
+        if str_len == 10:
+            value = datetime.strptime(t_str, "%Y-%m-%d")
+        elif str_len == 13:
+            value = datetime.strptime(t_str, "%Y-%m-%d %H")
+        elif str_len == 16:
+            value = datetime.strptime(t_str, "%Y-%m-%d %H:%M")
+        elif str_len == 19:
+            value = datetime.strptime(t_str, "%Y-%m-%d %H:%M:%S")
+        elif 21 <= str_len <= 26:
+            value = datetime.strptime(t_str, "%Y-%m-%d %H:%M:%S.%f")
+        else:
+            raise KeyError("Invalid time format.")
+    if offset_ms is None:
+        return value
+    return value.replace(tzinfo=timezone(timedelta(milliseconds=offset_ms)))
@@ -1,7 +1,7 @@
 from cacheout import Cache
 
-# global cache object:
-_cache = Cache()
+# global cache object, unbounded: it holds the meta of every table and stable of the database
+_cache = Cache(maxsize=0)
 
 
 def get(key, default=None):
@@ -17,5 +17,3 @@ def set(key, value, ttl=None):
 def delete(key):
     global _cache
     _cache.delete(key)
-
-
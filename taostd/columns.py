@@ -0,0 +1,117 @@
+"""
+Column-wise reading of query results, straight from the blocks fetched by the client library.
+"""
+import ctypes
+from taos.cinterface import taos_fetch_block_raw, taos_fetch_lengths
+from taos.constants import FieldType
+from taos.field import CONVERT_FUNC_BLOCK
+from taostd.model import TDError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# fixed width field type: (ctypes type, NULL value, NumPy dtype name)
+_FIXED_TYPES = {
+    FieldType.C_BOOL: (ctypes.c_int8, FieldType.C_BOOL_NULL, 'bool'),
+    FieldType.C_TINYINT: (ctypes.c_int8, FieldType.C_TINYINT_NULL, 'int8'),
+    FieldType.C_TINYINT_UNSIGNED: (ctypes.c_uint8, FieldType.C_TINYINT_UNSIGNED_NULL, 'uint8'),
+    FieldType.C_SMALLINT: (ctypes.c_int16, FieldType.C_SMALLINT_NULL, 'int16'),
+    FieldType.C_SMALLINT_UNSIGNED: (ctypes.c_uint16, FieldType.C_SMALLINT_UNSIGNED_NULL, 'uint16'),
+    FieldType.C_INT: (ctypes.c_int32, FieldType.C_INT_NULL, 'int32'),
+    FieldType.C_INT_UNSIGNED: (ctypes.c_uint32, FieldType.C_INT_UNSIGNED_NULL, 'uint32'),
+    FieldType.C_BIGINT: (ctypes.c_int64, FieldType.C_BIGINT_NULL, 'int64'),
+    FieldType.C_BIGINT_UNSIGNED: (ctypes.c_uint64, FieldType.C_BIGINT_UNSIGNED_NULL, 'uint64'),
+    FieldType.C_FLOAT: (ctypes.c_float, None, 'float32'),
+    FieldType.C_DOUBLE: (ctypes.c_double, None, 'float64'),
+    FieldType.C_TIMESTAMP: (ctypes.c_int64, FieldType.C_BIGINT_NULL, 'int64'),
+}
+# datetime64 unit of each result precision
+_DATETIME64_UNITS = {0: 'datetime64[ms]', 1: 'datetime64[us]', 2: 'datetime64[ns]'}
+
+
+def fetch_columns(result, names: list, as_numpy=False, datetime64=False):
+    """
+    Fetch the next block of result as one column per field.
+    TIMESTAMP columns are the int64 epoch in the precision of the result, or datetime64 with as_numpy and datetime64.
+    Lists hold None for NULL. NumPy integer and bool columns holding NULL become float64 with NaN, NULL TIMESTAMP
+    is NaT as datetime64 and -2**63 as int64.
+    :raise StopIteration: no more blocks
+    """
+    if as_numpy and np is None:
+        raise TDError("as_numpy needs numpy.")
+
+    block, num_rows = taos_fetch_block_raw(result._result)
+    if num_rows == 0:
+        raise StopIteration
+    fields = result.fields
+    precision = result.precision
+    lengths = taos_fetch_lengths(result._result, len(names))
+    pointers = ctypes.cast(block, ctypes.POINTER(ctypes.c_void_p))
+    columns = {}
+    for i, name in enumerate(names):
+        field_type = fields[i].type
+        data = pointers[i]
+        if field_type in _FIXED_TYPES and (as_numpy or field_type == FieldType.C_TIMESTAMP):
+            ctype, null, dtype = _FIXED_TYPES[field_type]
+            values = ctypes.cast(data, ctypes.POINTER(ctype))
+            if as_numpy:
+                column = np.ctypeslib.as_array(values, (num_rows,)).copy()
+                if field_type == FieldType.C_TIMESTAMP:
+                    if datetime64:
+                        column = column.view(_DATETIME64_UNITS.get(precision, 'datetime64[ms]'))
+                elif null is not None:
+                    is_null = column == np.array(null).astype(column.dtype)
+                    if is_null.any():
+                        column = column.astype('float64')
+                        column[is_null] = np.nan
+                    elif field_type == FieldType.C_BOOL:
+                        column = column.astype('bool')
+            else:
+                column = [None if v == null else v for v in values[:num_rows]]
+        elif field_type in CONVERT_FUNC_BLOCK:
+            column = CONVERT_FUNC_BLOCK[field_type](data, num_rows, lengths[i], precision)
+            if as_numpy:
+                column = np.array(column, dtype=object)
+        else:
+            raise TDError(f"Invalid data type {field_type} returned from database.")
+        columns[name] = column
+    return columns
+
+
+def empty_columns(result, names: list, as_numpy=False, datetime64=False):
+    """
+    Columns of a result without rows.
+    """
+    if not as_numpy:
+        return {name: [] for name in names}
+
+    fields = result.fields
+    columns = {}
+    for i, name in enumerate(names):
+        field_type = fields[i].type
+        if field_type == FieldType.C_TIMESTAMP and datetime64:
+            dtype = _DATETIME64_UNITS.get(result.precision, 'datetime64[ms]')
+        elif field_type in _FIXED_TYPES:
+            dtype = _FIXED_TYPES[field_type][2]
+        else:
+            dtype = object
+        columns[name] = np.empty(0, dtype=dtype)
+    return columns
+
+
+def concat_columns(blocks: list, as_numpy=False):
+    """
+    Join the column blocks of a result into one column per field.
+    """
+    columns = {}
+    for name in blocks[0]:
+        if as_numpy:
+            columns[name] = np.concatenate([block[name] for block in blocks])
+        else:
+            column = []
+            for block in blocks:
+                column.extend(block[name])
+            columns[name] = column
+    return columns
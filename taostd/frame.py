@@ -0,0 +1,154 @@
+"""
+Column buffers for pandas DataFrame / NumPy ingestion. NumPy is only needed when this module is used.
+"""
+import taos
+import numpy as np
+from ctypes import c_void_p, c_char_p, c_int32, POINTER
+from taos.constants import FieldType
+from taostd.model import TDError
+from taostd.bind import _offset_ms
+
+# NumPy dtype and TaosMultiBind buffer type for each field type
+_COLUMN_TYPES = {
+    'TIMESTAMP': (np.int64, FieldType.C_TIMESTAMP),
+    'BOOL': (np.int8, FieldType.C_BOOL),
+    'TINYINT': (np.int8, FieldType.C_TINYINT),
+    'TINYINT UNSIGNED': (np.uint8, FieldType.C_TINYINT_UNSIGNED),
+    'SMALLINT': (np.int16, FieldType.C_SMALLINT),
+    'SMALLINT UNSIGNED': (np.uint16, FieldType.C_SMALLINT_UNSIGNED),
+    'INT': (np.int32, FieldType.C_INT),
+    'INT UNSIGNED': (np.uint32, FieldType.C_INT_UNSIGNED),
+    'BIGINT': (np.int64, FieldType.C_BIGINT),
+    'BIGINT UNSIGNED': (np.uint64, FieldType.C_BIGINT_UNSIGNED),
+    'FLOAT': (np.float32, FieldType.C_FLOAT),
+    'DOUBLE': (np.float64, FieldType.C_DOUBLE),
+    'BINARY': (None, FieldType.C_BINARY),
+    'NCHAR': (None, FieldType.C_NCHAR),
+}
+
+
+class Column(object):
+    """
+    One value column converted to a contiguous buffer, with its null flags and, for strings, the byte lengths.
+    The column owns the buffers the TaosMultiBind arrays of bind_frame point into.
+    """
+
+    def __init__(self, buffer_type, data, is_null, lengths=None):
+        self.buffer_type = buffer_type
+        self.data = np.ascontiguousarray(data)
+        self.is_null = np.ascontiguousarray(is_null)
+        self.lengths = None if lengths is None else np.ascontiguousarray(lengths)
+
+
+def frame_length(df):
+    if hasattr(df, 'columns'):
+        return len(df)
+    for column in df.values():
+        return len(column)
+    return 0
+
+
+def frame_columns(fields: list, df, tz_offset):
+    """
+    Convert the columns of a DataFrame, or a dict of arrays, to one Column per value field of the stable.
+    Column names are matched case-insensitively, missing columns are bound as NULL.
+    :param fields: fields of the stable description
+    :param df: pandas DataFrame or {name: numpy array}
+    :param tz_offset: hours of the local time zone, naive datetime64 values are shifted to UTC by it
+    :return: [Column]
+    """
+    length = frame_length(df)
+    names = {str(name).lower(): name for name in (df.columns if hasattr(df, 'columns') else df.keys())}
+    columns = []
+    for f in fields:
+        if f['Note'] != "":
+            continue
+        field_type = f['Type']
+        if field_type not in _COLUMN_TYPES:
+            raise TDError(f"Unsupported field type '{field_type}'.")
+        dtype, buffer_type = _COLUMN_TYPES[field_type]
+        name = names.get(f['Field'])
+        if name is None:
+            data = np.zeros(length, dtype=dtype or 'S1')
+            lengths = None if dtype else np.zeros(length, dtype=np.int32)
+            columns.append(Column(buffer_type, data, np.ones(length, dtype=np.int8), lengths))
+            continue
+
+        column = df[name]
+        is_null = _is_null(column)
+        if field_type == 'TIMESTAMP':
+            data = _epoch_ms(column, is_null, tz_offset)
+            columns.append(Column(buffer_type, data, is_null.astype(np.int8)))
+        elif dtype is None:
+            values = np.asarray(column).astype(str)
+            data = np.char.encode(values, 'utf-8')
+            lengths = np.char.str_len(data).astype(np.int32)
+            columns.append(Column(buffer_type, data, is_null.astype(np.int8), lengths))
+        else:
+            values = np.asarray(column)
+            if is_null.any():
+                values = np.where(is_null, 0, values)
+            columns.append(Column(buffer_type, values.astype(dtype, copy=False), is_null.astype(np.int8)))
+    return columns
+
+
+def bind_frame(columns: list, start: int, end: int):
+    """
+    Bind rows [start, end) of the columns to a TaosMultiBind array. The array points into the column buffers,
+    so the columns must be kept alive until the statement is executed.
+    """
+    binds = taos.new_multi_binds(len(columns))
+    for i, column in enumerate(columns):
+        data = column.data[start:end]  # a view of the contiguous buffer of the column
+        bind = binds[i]
+        bind.buffer_type = column.buffer_type
+        bind.buffer = data.ctypes.data_as(c_void_p)
+        bind.buffer_length = data.itemsize
+        bind.num = len(data)
+        bind.is_null = column.is_null[start:end].ctypes.data_as(c_char_p)
+        if column.lengths is not None:
+            bind.length = column.lengths[start:end].ctypes.data_as(POINTER(c_int32))
+    return binds
+
+
+def frame_row(df, names, index=0):
+    """
+    Values of the given columns in one row, as Python scalars.
+    """
+    row = {}
+    for name in names:
+        column = df[name]
+        value = column.iloc[index] if hasattr(column, 'iloc') else column[index]
+        row[name] = value.item() if hasattr(value, 'item') else value
+    return row
+
+
+def _is_null(column):
+    if hasattr(column, 'isna'):
+        return column.isna().to_numpy()
+    values = np.asarray(column)
+    if values.dtype.kind == 'f':
+        return np.isnan(values)
+    if values.dtype.kind in 'mM':
+        return np.isnat(values)
+    if values.dtype.kind == 'O':
+        return np.equal(values, None)
+    return np.zeros(len(values), dtype=bool)
+
+
+def _epoch_ms(column, is_null, tz_offset):
+    """
+    Epoch milliseconds of a timestamp column in one vectorized step. Naive datetimes and strings are local time
+    at tz_offset, time zone aware datetimes are converted to UTC, integers are taken as epoch milliseconds and
+    floats as epoch seconds.
+    """
+    if getattr(column.dtype, 'tz', None) is not None:
+        return column.dt.tz_convert(None).to_numpy().astype('datetime64[ms]').view(np.int64)
+
+    values = np.asarray(column)
+    kind = values.dtype.kind
+    if kind in 'iu':
+        return values.astype(np.int64)
+    if kind == 'f':
+        return np.rint(np.where(is_null, 0, values) * 1000).astype(np.int64)
+    return values.astype('datetime64[ms]').view(np.int64) - _offset_ms(tz_offset)
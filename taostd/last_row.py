@@ -0,0 +1,134 @@
+"""
+In-process store of the last row written into each table, fed by the insert functions of td, so "latest value per
+device" reads do not go to the server. The newest row of each stable, and of each tag value of a stable, is tracked
+among the stored tables.
+"""
+import threading
+from collections import OrderedDict
+from taostd.bind import to_epoch, lookup, _offset_ms
+
+
+class LastRowStore(object):
+    """
+    A table is kept as one tuple (stable, names, epoch, values, tags): names are the column and tag names of the
+    stable shared by all its tables, values and tags are the values as they were written. The least recently
+    written or read tables are evicted beyond max_tables.
+    store = LastRowStore(100000)
+    store.update([('meter_01', 'meters', (['ts', 'current'], ['location']), {'ts': now, 'current': 0.3})])
+    row = store.get('meter_01')
+    """
+
+    def __init__(self, max_tables=100000, tz_offset=8):
+        """
+        :param max_tables: tables kept, a table takes about 200 bytes plus its values
+        :param tz_offset: hours of the local time zone of naive datetime and str timestamps
+        """
+        self.max_tables = max_tables
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._offset_ms = _offset_ms(tz_offset)
+        self._lock = threading.Lock()
+        self._tables = OrderedDict()  # table -> (stable, names, epoch, values, tags)
+        self._latest = {}  # (stable, tag, value) or (stable, None, None) -> (epoch, table)
+
+    def update(self, rows):
+        """
+        keep the newest of the rows of each table.
+        :param rows: [(table, stable, (column names, tag names), row)], the first column is the timestamp, the keys
+                     of row are matched case-insensitively like the binder does
+        """
+        newest = {}  # table -> (epoch, stable, names, row)
+        for table, stable, names, row in rows:
+            ts = lookup(row, names[0][0])
+            if ts is None:
+                continue
+            epoch = to_epoch(ts, self._offset_ms)
+            current = newest.get(table)
+            if current is None or epoch >= current[0]:
+                newest[table] = (epoch, stable, names, row)
+
+        with self._lock:
+            for table, (epoch, stable, names, row) in newest.items():
+                entry = self._tables.get(table)
+                if entry is not None and entry[1] is names and entry[2] > epoch:
+                    continue
+                columns, tag_names = names
+                lowered = {str(k).lower(): v for k, v in row.items()}
+                if any(name in lowered for name in tag_names):
+                    tags = tuple(lowered.get(name) for name in tag_names)
+                elif entry is not None and entry[1] is names:
+                    tags = entry[4]
+                else:
+                    tags = None
+                self._tables[table] = (stable, names, epoch, tuple(lookup(row, name) for name in columns), tags)
+                self._tables.move_to_end(table)
+                for key in self._keys(stable, tag_names, tags):
+                    latest = self._latest.get(key)
+                    if latest is None or latest[0] <= epoch:
+                        self._latest[key] = (epoch, table)
+            while len(self._tables) > self.max_tables:
+                table, entry = self._tables.popitem(last=False)
+                self._drop(table, entry)
+                self.evictions += 1
+
+    def get(self, table: str):
+        """
+        :return: {column: value} of the last row of table, None when it is not stored
+        """
+        with self._lock:
+            entry = self._tables.get(table)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._tables.move_to_end(table)
+            self.hits += 1
+        return dict(zip(entry[1][0], entry[3]))
+
+    def get_latest(self, stable: str, tag=None, value=None):
+        """
+        :return: (table, {column: value}) of the newest row of the stored tables of stable, of the ones whose tag
+                 is value when tag is given, None when there is none
+        """
+        key = (stable, tag.lower() if tag else None, value if tag else None)
+        with self._lock:
+            latest = self._latest.get(key)
+            entry = self._tables.get(latest[1]) if latest else None
+            if entry is None or entry[2] != latest[0]:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return latest[1], dict(zip(entry[1][0], entry[3]))
+
+    def discard(self, tables):
+        with self._lock:
+            for table in tables:
+                entry = self._tables.pop(table, None)
+                if entry is not None:
+                    self._drop(table, entry)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._latest.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'tables': len(self._tables)}
+
+    def __len__(self):
+        return len(self._tables)
+
+    def _drop(self, table, entry):
+        stable, names, _, _, tags = entry
+        for key in self._keys(stable, names[1], tags):
+            latest = self._latest.get(key)
+            if latest is not None and latest[1] == table:
+                del self._latest[key]
+
+    @staticmethod
+    def _keys(stable, tag_names, tags):
+        yield stable, None, None
+        if tags is not None:
+            for name, value in zip(tag_names, tags):
+                if value is not None:
+                    yield stable, name, value
@@ -0,0 +1,129 @@
+"""
+InfluxDB line protocol serializer for the schemaless insert of TDengine, which creates stables, tables, tags and
+columns by itself.
+"""
+from datetime import datetime
+from taostd.model import TDError
+from taostd.bind import to_epoch, _offset_ms
+
+# bytes of lines sent in one schemaless insert
+MAX_LINES_BYTES = 1 << 20
+# epoch in the precision of the lines: factor applied to epoch milliseconds
+_PRECISION_FACTORS = {'h': 1 / 3600000, 'm': 1 / 60000, 's': 1 / 1000, 'ms': 1, 'us': 1000, 'ns': 1000000}
+# field type suffix in line protocol
+_FIELD_SUFFIXES = {
+    'TINYINT': 'i8',
+    'TINYINT UNSIGNED': 'u8',
+    'SMALLINT': 'i16',
+    'SMALLINT UNSIGNED': 'u16',
+    'INT': 'i32',
+    'INT UNSIGNED': 'u32',
+    'BIGINT': 'i64',
+    'BIGINT UNSIGNED': 'u64',
+    'FLOAT': 'f32',
+    'DOUBLE': 'f64',
+}
+_KEY_ESCAPES = str.maketrans({',': '\\,', '=': '\\=', ' ': '\\ '})
+_MEASUREMENT_ESCAPES = str.maketrans({',': '\\,', ' ': '\\ '})
+_STRING_ESCAPES = str.maketrans({'"': '\\"', '\\': '\\\\'})
+
+
+def to_lines(args: list, stables: dict, tz_offset, precision='ms', ts='ts', table_tag=None):
+    """
+    Serialize rows like the ones of insert_many_tables into line protocol.
+    :param args: [{"stable": xxx, ["table": xxx,] "ts": ..., tags..., fields...}]
+    :param stables: {stable: {field: (type, is_tag)}}, the fields not in it are tags when they are str and columns
+                    otherwise, their types are inferred from the values
+    :param tz_offset: hours of the local time zone of naive datetime and str timestamps
+    :param precision: precision of the timestamps in the lines: 'h', 'm', 's', 'ms', 'us' or 'ns'.
+                      int timestamps are taken as they are, the others are converted from epoch milliseconds.
+                      The other TIMESTAMP columns are sent the same way as i64
+    :param ts: field of the timestamp
+    :param table_tag: tag holding the table name, it must be the smlChildTableName of the server,
+                      None lets the server name the tables from their tags
+    :return: [line]
+    """
+    factor = _PRECISION_FACTORS.get(precision)
+    if factor is None:
+        raise TDError(f"Invalid precision '{precision}', expect one of {tuple(_PRECISION_FACTORS)}.")
+    offset_ms = _offset_ms(tz_offset)
+    lines = []
+    for arg in args:
+        stable = arg.get("stable")
+        if not stable:
+            raise TDError("'stable' is expected.")
+        fields = stables.get(stable) or {}
+        tags = []
+        values = []
+        timestamp = None
+        for name, value in arg.items():
+            if name == 'stable' or name == 'table' or value is None:
+                continue
+            if name == ts:
+                timestamp = _timestamp(value, offset_ms, factor)
+                continue
+            field = fields.get(name.lower())
+            if field is None:
+                field = (None, isinstance(value, str))
+            if field[1]:
+                tags.append(f"{str(name).translate(_KEY_ESCAPES)}={str(value).translate(_KEY_ESCAPES)}")
+            else:
+                if field[0] == 'TIMESTAMP' or isinstance(value, datetime):
+                    # a timestamp column other than ts: epoch in the precision of the lines
+                    value = f"{_timestamp(value, offset_ms, factor)}i64"
+                else:
+                    value = _field_value(value, field[0])
+                values.append(f"{str(name).translate(_KEY_ESCAPES)}={value}")
+        if table_tag and arg.get("table"):
+            tags.append(f"{table_tag}={arg['table'].translate(_KEY_ESCAPES)}")
+        if not values:
+            raise TDError(f"Row of '{stable}' has no field value.")
+
+        line = stable.translate(_MEASUREMENT_ESCAPES)
+        if tags:
+            line += ',' + ','.join(tags)
+        line += ' ' + ','.join(values)
+        if timestamp is not None:
+            line += f" {timestamp}"
+        lines.append(line)
+    return lines
+
+
+def batch_lines(lines: list, max_bytes=MAX_LINES_BYTES):
+    """
+    Split lines into batches of at most max_bytes of UTF-8, a line longer than max_bytes is a batch by itself.
+    """
+    batch = []
+    size = 0
+    for line in lines:
+        length = len(line.encode()) + 1
+        if batch and size + length > max_bytes:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(line)
+        size += length
+    if batch:
+        yield batch
+
+
+def _timestamp(value, offset_ms, factor):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    epoch = to_epoch(value, offset_ms)
+    return epoch * factor if factor >= 1 else int(epoch * factor)
+
+
+def _field_value(value, field_type):
+    if field_type == 'BOOL' or isinstance(value, bool):
+        return 'true' if value else 'false'
+    if field_type == 'BINARY':
+        return f'"{str(value).translate(_STRING_ESCAPES)}"'
+    if field_type == 'NCHAR' or isinstance(value, str):
+        return f'L"{str(value).translate(_STRING_ESCAPES)}"'
+    suffix = _FIELD_SUFFIXES.get(field_type)
+    if suffix is None:
+        suffix = 'i64' if isinstance(value, int) else 'f64'
+    elif suffix[0] != 'f':
+        value = int(value)
+    return f"{value}{suffix}"
@@ -0,0 +1,170 @@
+"""
+Instrumentation of the hot paths. Nothing is recorded until a hook is added, then every timing and counter event is
+passed to the hooks. Registry is the built-in hook, it keeps latency histograms and counters in memory and dumps
+them as Prometheus text.
+    from taostd import metrics
+    registry = metrics.enable()
+    td.insert_many('meter_01', rows)
+    print(registry.dump())
+"""
+import time
+import bisect
+import logging
+import threading
+
+# latency buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_hooks = ()
+# read by the instrumented code before taking any time, False while there is no hook
+enabled = False
+
+
+class Hook(object):
+    """
+    Receiver of the events, override the methods of the events it records.
+    """
+
+    def on_timing(self, name: str, seconds: float, rows: int, nbytes: int):
+        """
+        an operation took seconds and handled rows and nbytes, both are 0 when they do not apply.
+        names: pool_wait, query, cursor_execute, stmt_prepare, stmt_execute, bind, bind_columns, meta_lookup
+        """
+
+    def on_count(self, name: str, value: int):
+        """
+        names: table_cache_hit, table_cache_miss, stable_cache_hit, stable_cache_miss, stmt_cache_hit,
+        stmt_cache_miss, query_cache_hit, query_cache_miss, query_cache_coalesced, last_row_hit, last_row_miss
+        """
+
+
+class Registry(Hook):
+    """
+    In-memory histograms of the timings, with their rows and bytes totals, and counters.
+    """
+
+    def __init__(self, buckets=BUCKETS, prefix='taostd'):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._timings = {}  # name -> [bucket counts, sum, count, rows, bytes]
+        self._counters = {}
+
+    def on_timing(self, name, seconds, rows, nbytes):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0, 0]
+            timing[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            timing[1] += seconds
+            timing[2] += 1
+            timing[3] += rows
+            timing[4] += nbytes
+
+    def on_count(self, name, value):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self):
+        """
+        :return: {name: {'count', 'sum', 'rows', 'bytes', 'buckets': {le: cumulative count}}}, {counter: value}
+        """
+        with self._lock:
+            timings = {}
+            for name, (counts, total, count, rows, nbytes) in self._timings.items():
+                cumulative = 0
+                buckets = {}
+                for le, n in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    buckets[le] = cumulative
+                timings[name] = {'count': count, 'sum': total, 'rows': rows, 'bytes': nbytes, 'buckets': buckets}
+            return timings, dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+
+    def dump(self):
+        """
+        the metrics in the Prometheus text exposition format.
+        """
+        timings, counters = self.snapshot()
+        lines = []
+        for name, timing in sorted(timings.items()):
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for le, n in timing['buckets'].items():
+                lines.append(f'{metric}_bucket{{le="{"+Inf" if le == float("inf") else le}"}} {n}')
+            lines.append(f"{metric}_sum {timing['sum']}")
+            lines.append(f"{metric}_count {timing['count']}")
+            for unit in ('rows', 'bytes'):
+                if timing[unit]:
+                    lines.append(f"# TYPE {self.prefix}_{name}_{unit}_total counter")
+                    lines.append(f"{self.prefix}_{name}_{unit}_total {timing[unit]}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+        return '\n'.join(lines) + '\n'
+
+
+# the registry of enable()
+REGISTRY = Registry()
+
+
+def add_hook(hook: Hook):
+    global _hooks
+    global enabled
+    if hook not in _hooks:
+        _hooks = _hooks + (hook,)
+    enabled = True
+
+
+def remove_hook(hook: Hook):
+    global _hooks
+    global enabled
+    _hooks = tuple(h for h in _hooks if h is not hook)
+    enabled = bool(_hooks)
+
+
+def enable():
+    """
+    record into REGISTRY and return it.
+    """
+    add_hook(REGISTRY)
+    return REGISTRY
+
+
+def disable():
+    remove_hook(REGISTRY)
+
+
+def start():
+    """
+    start time of a timing event, None when there is no hook.
+    """
+    return time.perf_counter() if enabled else None
+
+
+def timing(name: str, start_time, rows=0, nbytes=0):
+    """
+    end a timing event started by start().
+    """
+    if start_time is None:
+        return
+    seconds = time.perf_counter() - start_time
+    for hook in _hooks:
+        try:
+            hook.on_timing(name, seconds, rows, nbytes)
+        except Exception:
+            logging.exception(f"metrics hook {hook!r} error.")
+
+
+def count(name: str, value=1):
+    if not enabled:
+        return
+    for hook in _hooks:
+        try:
+            hook.on_count(name, value)
+        except Exception:
+            logging.exception(f"metrics hook {hook!r} error.")
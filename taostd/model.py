@@ -1,6 +1,8 @@
+import time
 import logging
 import threading
-from queue import Empty
+from collections import OrderedDict, namedtuple
+from taostd import metrics
 
 
 class Engine(object):
@@ -12,6 +14,289 @@ class Engine(object):
         return self._connect()
 
 
+class StatementCache(object):
+    """
+    LRU of the prepared statements of one connection, keyed by SQL. At least one statement is kept.
+    StatementCache.invalidate() closes the statements of every connection the next time it is used.
+    """
+    _epoch = 0
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stmts = OrderedDict()
+        self._epoch = StatementCache._epoch
+
+    @classmethod
+    def invalidate(cls):
+        cls._epoch += 1
+
+    def get(self, connection, sql):
+        if self._epoch != StatementCache._epoch:
+            self.clear()
+            self._epoch = StatementCache._epoch
+
+        stmt = self._stmts.get(sql)
+        if stmt is not None:
+            self._stmts.move_to_end(sql)
+            self.hits += 1
+            metrics.count('stmt_cache_hit')
+            return stmt
+
+        self.misses += 1
+        metrics.count('stmt_cache_miss')
+        while self._stmts and len(self._stmts) >= self.maxsize:
+            _, evicted = self._stmts.popitem(last=False)
+            evicted.close()
+            self.evictions += 1
+        start = metrics.start()
+        stmt = connection.statement(sql)
+        metrics.timing('stmt_prepare', start, nbytes=len(sql))
+        self._stmts[sql] = stmt
+        return stmt
+
+    def discard(self, sql):
+        stmt = self._stmts.pop(sql, None)
+        if stmt is not None:
+            stmt.close()
+
+    def clear(self):
+        while self._stmts:
+            _, stmt = self._stmts.popitem()
+            stmt.close()
+
+    def __len__(self):
+        return len(self._stmts)
+
+
+class Connection(object):
+    """
+    Pooled connection: the taos connection and the statements prepared on it.
+    """
+
+    def __init__(self, engine, stmt_cache_size=64):
+        self.engine = engine
+        self.conn = engine.connect()
+        self.statements = StatementCache(stmt_cache_size)
+        self.last_used = time.monotonic()
+        # iter_select generators reading from the connection, the last one releases it when one of them checked it out
+        self.iterations = 0
+        self.release_after_iterations = False
+
+    def query(self, sql):
+        return self.conn.query(sql)
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def statement(self, sql):
+        """
+        Return the cached statement prepared for sql
+        """
+        return self.statements.get(self.conn, sql)
+
+    def schemaless_insert(self, lines, protocol, precision):
+        return self.conn.schemaless_insert(lines, protocol, precision)
+
+    def ping(self, sql):
+        """
+        Return whether the connection works, by running sql.
+        """
+        try:
+            self.conn.query(sql).close()
+            return True
+        except Exception as err:
+            logging.warning(f"connection <{hex(id(self))}> is broken: {err}")
+            return False
+
+    def reconnect(self):
+        self.close()
+        self.conn = self.engine.connect()
+        logging.info(f"connection <{hex(id(self))}> reconnected")
+
+    def close(self):
+        self.statements.clear()
+        if self.conn is None:
+            return
+        try:
+            self.conn.close()
+        except Exception as err:
+            logging.debug(f"close connection <{hex(id(self))}> error: {err}")
+        self.conn = None
+
+
+# taos error numbers of a broken connection: network unavailable, RPC not ready, FQDN error
+_CONNECTION_ERRNOS = (0x000B, 0x0005, 0x0015)
+
+
+def is_connection_error(err):
+    """
+    Return whether err means that the connection is broken and should not be reused.
+    """
+    if err is None:
+        return False
+    if type(err).__name__ == 'ConnectionError':
+        return True
+    errno = getattr(err, 'errno', None)
+    return isinstance(errno, int) and errno & 0xffff in _CONNECTION_ERRNOS
+
+
+class ConnectionPool(object):
+    """
+    Pool that opens min_size connections at start and grows lazily up to max_size.
+    acquire() waits at most timeout seconds for a connection. Idle connections over min_size are closed after
+    idle_timeout seconds, a connection idle for validate_interval seconds is validated on checkout and reconnected
+    when it fails, and a connection released as broken is reopened on its next checkout.
+    """
+
+    def __init__(self, engine, min_size=1, max_size=None, timeout=None, idle_timeout=300, validate_interval=30,
+                 validate_sql="select server_status()", stmt_cache_size=64):
+        self.engine = engine
+        self.min_size = min_size
+        self.max_size = max(max_size or min_size, min_size)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.validate_interval = validate_interval
+        self.validate_sql = validate_sql
+        self.stmt_cache_size = stmt_cache_size
+        self.metrics = {'checkouts': 0, 'waits': 0, 'wait_time': 0.0, 'max_wait_time': 0.0, 'timeouts': 0,
+                        'created': 0, 'closed': 0, 'reconnects': 0, 'validation_failures': 0}
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._connections = []
+        self._size = 0
+        self._closed = False
+        for _ in range(min_size):
+            self._idle.append(self._create())
+            self._size += 1
+
+    @property
+    def connections(self):
+        """
+        All the open connections, idle or in use.
+        """
+        return list(self._connections)
+
+    def acquire(self, timeout=None):
+        """
+        Check out a connection, waiting at most timeout seconds, default is the timeout of the pool.
+        :raise PoolTimeoutError: no connection is released in time
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise TDError('Connection pool is closed.')
+                self._evict_idle()
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = None if timeout is None else start + timeout - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeoutError(f"No connection is available in {timeout} seconds, pool size {self._size}.")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self.metrics['checkouts'] += 1
+            if waited > 0.001:
+                self.metrics['waits'] += 1
+                self.metrics['wait_time'] += waited
+                self.metrics['max_wait_time'] = max(self.metrics['max_wait_time'], waited)
+
+        if conn is None:
+            try:
+                return self._create()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        reconnect = conn.conn is None
+        if not reconnect and self.validate_interval is not None \
+                and time.monotonic() - conn.last_used >= self.validate_interval and not conn.ping(self.validate_sql):
+            self.metrics['validation_failures'] += 1
+            reconnect = True
+        if reconnect:
+            try:
+                conn.reconnect()
+            except Exception:
+                self._discard(conn)
+                raise
+            self.metrics['reconnects'] += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        """
+        Return a connection to the pool. A broken connection is closed and reopened on its next checkout.
+        """
+        conn.last_used = time.monotonic()
+        if broken:
+            logging.warning(f"connection <{hex(id(conn))}> is broken, it is reopened on next checkout")
+            conn.close()
+        with self._cond:
+            if self._closed:
+                self._discard_locked(conn)
+            else:
+                self._idle.append(conn)
+                self._evict_idle()
+            self._cond.notify()
+
+    def stats(self):
+        """
+        :return: pool size, idle and in-use connections, and the checkout metrics
+        """
+        with self._cond:
+            stats = {'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                     'min_size': self.min_size, 'max_size': self.max_size}
+            stats.update(self.metrics)
+        return stats
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard_locked(self._idle.pop())
+            self._cond.notify_all()
+
+    def _create(self):
+        conn = Connection(self.engine, self.stmt_cache_size)
+        self._connections.append(conn)
+        self.metrics['created'] += 1
+        logging.debug('open connection <%s>...' % hex(id(conn)))
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._discard_locked(conn)
+            self._cond.notify()
+
+    def _discard_locked(self, conn):
+        conn.close()
+        if conn in self._connections:
+            self._connections.remove(conn)
+        self._size -= 1
+        self.metrics['closed'] += 1
+        logging.debug('close connection <%s>...' % hex(id(conn)))
+
+    def _evict_idle(self):
+        if self.idle_timeout is None:
+            return
+        now = time.monotonic()
+        # idle connections are used last in first out, so the oldest ones are at the front
+        while self._idle and self._size > self.min_size and now - self._idle[0].last_used >= self.idle_timeout:
+            self._discard_locked(self._idle.pop(0))
+
+
 class TDCtx(threading.local):
     """
     Thread local object that holds connection info.
@@ -25,13 +310,13 @@ class TDCtx(threading.local):
         return self.connection is not None
 
     def init(self):
-        self.connection = self.pool.get()
+        self.connection = self.pool.acquire()
         logging.debug('use connection <%s>...' % hex(id(self.connection)))
 
-    def cleanup(self):
-        self.pool.put_nowait(self.connection)
-        self.connection = None
+    def cleanup(self, broken=False):
         logging.debug('release connection <%s>...' % hex(id(self.connection)))
+        self.pool.release(self.connection, broken)
+        self.connection = None
 
     def cursor(self):
         """
@@ -46,14 +331,7 @@ class TDCtx(threading.local):
         return self.connection.statement(sql)
 
     def __del__(self):
-        try:
-            while True:
-                conn = self.pool.get_nowait()
-                if conn:
-                    conn.close()
-                    logging.debug('close connection <%s>...' % hex(id(conn)))
-        except Empty:
-            pass
+        self.pool.close()
 
 
 class ConnectionCtx(object):
@@ -72,13 +350,34 @@ class ConnectionCtx(object):
     def __enter__(self):
         self.should_cleanup = False
         if not self.db_ctx.is_init():
+            start = metrics.start()
             self.db_ctx.init()
+            metrics.timing('pool_wait', start)
             self.should_cleanup = True
         return self
 
     def __exit__(self, exctype, excvalue, traceback):
         if self.should_cleanup:
-            self.db_ctx.cleanup()
+            self.db_ctx.cleanup(is_connection_error(excvalue))
+
+
+class InsertResult(int):
+    """
+    affected rows of a bulk insert, with the rows that could not be inserted.
+    rejected: [(row, error)]
+    """
+
+    def __new__(cls, affected_rows=0, rejected=None):
+        result = super(InsertResult, cls).__new__(cls, affected_rows)
+        result.rejected = rejected if rejected is not None else []
+        return result
+
+    @property
+    def affected_rows(self):
+        return int(self)
+
+    def __repr__(self):
+        return f"InsertResult(affected_rows={int(self)}, rejected={len(self.rejected)})"
 
 
 class TDError(Exception):
@@ -89,6 +388,10 @@ class MultiColumnsError(TDError):
     pass
 
 
+class PoolTimeoutError(TDError):
+    pass
+
+
 class Dict(dict):
     """
     Simple dict but support access as x.y style.
@@ -133,3 +436,77 @@ class Dict(dict):
     def __setattr__(self, key, value):
         self[key] = value
 
+
+class Row(tuple):
+    """
+    Compact row: a tuple that also supports access by field name as x.y and x['y'].
+    Row classes are generated and cached per field names tuple by row_class().
+    >>> R = row_class(('ts', 'current', 'last(phase)'))
+    >>> r = R._make((1, 0.5, 2))
+    >>> r.current, r['current'], r[1]
+    (0.5, 0.5, 0.5)
+    >>> r['last(phase)']
+    2
+    >>> r.get('voltage') is None
+    True
+    >>> dict(r)
+    {'ts': 1, 'current': 0.5, 'last(phase)': 2}
+    """
+    __slots__ = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return [tuple.__getitem__(self, i) for i in self._index.values()]
+
+    def items(self):
+        return [(name, tuple.__getitem__(self, i)) for name, i in self._index.items()]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def _asdict(self):
+        return dict(self.items())
+
+    def __reduce__(self):
+        return _new_row, (self._fields, tuple(self))
+
+
+_row_classes = {}
+# methods of Row, a field of the same name is not accessible as x.y: select returns Dict rows then
+ROW_METHODS = frozenset(('get', 'keys', 'values', 'items'))
+
+
+def row_class(names: tuple):
+    """
+    Return the Row class of the field names, generated once per names tuple.
+    Names that are valid identifiers are also attributes, the others are only accessible as x['y'].
+    """
+    cls = _row_classes.get(names)
+    if cls is None:
+        base = namedtuple('Row', names, rename=True)
+        index = {}
+        for i, name in enumerate(names):
+            index.setdefault(name, i)
+        cls = type('Row', (Row, base), {'__slots__': (), '_fields': names, '_index': index,
+                                        '__getitem__': Row.__getitem__, '__reduce__': Row.__reduce__})
+        _row_classes[names] = cls
+    return cls
+
+
+def _new_row(names, values):
+    return row_class(names)._make(values)
@@ -0,0 +1,163 @@
+"""
+Cache of the results of select queries for td.get, td.select_one and td.select. Entries are keyed by the normalized
+SQL, expire after their ttl, are evicted in LRU order beyond maxsize and are invalidated when taostd writes to a
+table or stable the SQL reads from. Concurrent identical queries are sent to the server once.
+"""
+import re
+import threading
+from cacheout import LRUCache
+from taostd import metrics
+
+# quoted literals, the rest of the SQL is normalized
+_QUOTED = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+_SPACES = re.compile(r"\s+")
+# tables and stables after FROM or JOIN, with an optional database prefix
+_NAME = r"(?:`?\w+`?\.)?`?\w+`?"
+_TABLES = re.compile(rf"\b(?:from|join)\s+({_NAME}(?:\s*,\s*{_NAME})*)")
+_MISS = object()
+
+
+def normalize(sql: str):
+    """
+    sql with its whitespace collapsed, lower-cased outside the quoted literals and without the ending ';'.
+    """
+    parts = _QUOTED.split(sql.strip().rstrip(';').strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = _SPACES.sub(' ', parts[i]).lower()
+    return ''.join(parts)
+
+
+def tables_of(sql: str):
+    """
+    names of the tables and stables a normalized sql reads from, without their database.
+    """
+    unquoted = ' '.join(_QUOTED.split(sql)[::2])
+    names = set()
+    for matched in _TABLES.finditer(unquoted):
+        for name in matched.group(1).split(','):
+            names.add(name.strip().split('.')[-1].strip('`'))
+    return frozenset(names)
+
+
+class _Flight(object):
+    """
+    a query being sent to the server, the identical queries wait for its result.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.invalidated = False
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class QueryCache(object):
+    """
+    query_cache = QueryCache(maxsize=1024)
+    value = query_cache.get(('get', normalize(sql)), normalize(sql), 1.0, lambda: query(sql))
+    query_cache.invalidate(['meters', 'meter_01'])
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        :param maxsize: entries kept, the least recently used ones are evicted beyond it
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._index = {}  # table or stable -> {key}
+        self._indexed = 0
+        self._flights = {}  # key -> _Flight
+
+    def get(self, key, sql: str, ttl, query):
+        """
+        the cached value of key, or the value of query() cached for ttl seconds. query() is called once for the
+        concurrent calls of a key, the others wait for its value or error.
+        :param sql: normalized SQL of the query, its tables invalidate the entry
+        """
+        value = self._entries.get(key, _MISS)
+        if value is not _MISS:
+            self.hits += 1
+            metrics.count('query_cache_hit')
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(tables_of(sql))
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        metrics.count('query_cache_miss' if leader else 'query_cache_coalesced')
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.value = query()
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and not flight.invalidated:
+                    self._put(key, flight.value, ttl, flight.tables)
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, names):
+        """
+        drop the entries reading from the tables or stables names, the queries in flight are not cached.
+        """
+        names = set(names)
+        with self._lock:
+            for name in names:
+                for key in self._index.pop(name, ()):
+                    self._entries.delete(key)
+                    self.invalidations += 1
+            for flight in self._flights.values():
+                if not flight.tables.isdisjoint(names):
+                    flight.invalidated = True
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._index.clear()
+            self._indexed = 0
+            for flight in self._flights.values():
+                flight.invalidated = True
+
+    @property
+    def watching(self):
+        """
+        False when no entry nor query in flight reads from a known table, so a write has nothing to invalidate.
+        """
+        return bool(self._index or self._flights)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                'invalidations': self.invalidations, 'size': len(self._entries)}
+
+    def _put(self, key, value, ttl, tables):
+        self._entries.set(key, value, ttl)
+        for name in tables:
+            self._index.setdefault(name, set()).add(key)
+        self._indexed += len(tables)
+        if self._indexed > 4 * self.maxsize:
+            # drop the keys of the expired and evicted entries
+            self._index = {name: live for name, live in
+                           ((name, {k for k in keys if self._entries.has(k)}) for name, keys in self._index.items())
+                           if live}
+            self._indexed = sum(len(keys) for keys in self._index.values())
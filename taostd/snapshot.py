@@ -0,0 +1,120 @@
+"""
+Local snapshot of the table meta cache in a sqlite file, so a restarted process loads the table -> stable map and
+the stable descriptions without scanning the server.
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+# bump when the layout of the snapshot changes, an older snapshot is discarded
+_FORMAT = '1'
+
+
+class Snapshot(object):
+    """
+    snapshot = Snapshot('/data/taostd.meta', 'test')
+    stables, tables = snapshot.load()
+    """
+
+    def __init__(self, path: str, database: str):
+        """
+        :param path: sqlite file, created when it does not exist
+        :param database: the snapshot of another database in the same file is discarded
+        """
+        self.path = path
+        self.database = database
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS stables (name TEXT PRIMARY KEY, desc TEXT, updated REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS tables (name TEXT PRIMARY KEY, stable TEXT)")
+
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        if meta.get('format') != _FORMAT or meta.get('database') != database:
+            if meta:
+                logging.info(f"Discard meta snapshot '{path}' of database '{meta.get('database')}', "
+                             f"format {meta.get('format')}.")
+            with self._transaction():
+                self._db.execute("DELETE FROM stables")
+                self._db.execute("DELETE FROM tables")
+                self._db.execute("DELETE FROM meta")
+                self._set_meta(format=_FORMAT, database=database, created=time.time())
+
+    def load(self):
+        """
+        :return: ({stable: (stbl, fields)}, {table: stable})
+        """
+        with self._lock:
+            stables = {}
+            for name, desc in self._db.execute("SELECT name, desc FROM stables"):
+                desc = json.loads(desc)
+                stables[name] = (desc['stable'], desc['fields'])
+            tables = dict(self._db.execute("SELECT name, stable FROM tables"))
+        return stables, tables
+
+    @property
+    def reconciled(self):
+        """
+        time of the last full reconcile with the server, None if it never ended.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'reconciled'").fetchone()
+        return float(row[0]) if row else None
+
+    def put_stable(self, stbl: dict, fields: list):
+        desc = json.dumps({'stable': {k: stbl[k] for k in ('name', 'columns', 'tags')}, 'fields': fields})
+        with self._transaction():
+            self._db.execute("INSERT OR REPLACE INTO stables VALUES (?, ?, ?)", (stbl['name'], desc, time.time()))
+
+    def put_tables(self, tables: list):
+        """
+        :param tables: [(table, stable)]
+        """
+        if tables:
+            with self._transaction():
+                self._db.executemany("INSERT OR REPLACE INTO tables VALUES (?, ?)", tables)
+
+    def delete(self, names: list):
+        """
+        delete tables or stables.
+        """
+        if names:
+            params = [(name,) for name in names]
+            with self._transaction():
+                self._db.executemany("DELETE FROM tables WHERE name = ?", params)
+                self._db.executemany("DELETE FROM stables WHERE name = ?", params)
+
+    def mark_reconciled(self):
+        with self._transaction():
+            self._set_meta(reconciled=time.time())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _set_meta(self, **kwargs):
+        self._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in kwargs.items()])
+
+    def _transaction(self):
+        return _Transaction(self._db, self._lock)
+
+
+class _Transaction(object):
+
+    def __init__(self, db, lock):
+        self.db = db
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.db.execute("BEGIN")
+
+    def __exit__(self, exctype, excvalue, traceback):
+        try:
+            self.db.execute("ROLLBACK" if exctype else "COMMIT")
+        finally:
+            self.lock.release()
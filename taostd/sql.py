@@ -1,7 +1,11 @@
+import json
 from taostd.model import TDError
 from taostd import cache
 from datetime import datetime, timedelta
 
+# default maxSQLLength of the server, in bytes
+MAX_SQL_BYTES = 65480
+
 
 def get_sql_tags(tags, **kwargs):
     have_tag = False
@@ -14,11 +18,7 @@ def get_sql_tags(tags, **kwargs):
             tag_values.append("NULL")
         else:
             have_tag = True
-            field_type = tag['Type']
-            if field_type == 'BINARY' or field_type == 'NCHAR':
-                tag_values.append(f"'{param}'")
-            else:
-                tag_values.append(f"{param}")
+            tag_values.append(sql_literal(param, tag['Type']))
 
     if not have_tag:
         raise TDError(f"参数中没有包含tag，tag字段有：{','.join([tag['Field'] for tag in tags])}")
@@ -30,18 +30,132 @@ def get_sql_values(fields, arg):
     values = []
     arg = {k.lower(): v for k, v in arg.items()}
     for f in fields:
-        param = arg.get(f['Field'])
-        field_type = f['Type']
-        if param is None:
-            values.append("NULL")
-        elif field_type == 'BINARY' or field_type == 'NCHAR' or field_type == 'TIMESTAMP':
-            values.append(f"'{param}'")
-        else:
-            values.append(f"{param}")
+        values.append(sql_literal(arg.get(f['Field']), f['Type']))
 
     return ','.join(values)
 
 
+def escape(value: str):
+    """
+    escape a string to be quoted with ' in SQL.
+    """
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def sql_literal(value, field_type: str):
+    """
+    SQL text of a value of field_type. Strings are quoted and escaped, an int TIMESTAMP is the epoch in the
+    precision of the database, datetime and str TIMESTAMP are quoted as local time.
+    """
+    if value is None:
+        return "NULL"
+    if field_type == 'BINARY' or field_type == 'NCHAR':
+        return f"'{escape(str(value))}'"
+    if field_type == 'TIMESTAMP':
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value)
+        return f"'{escape(str(value))}'"
+    if field_type == 'BOOL':
+        return 'true' if value else 'false'
+    if field_type == 'JSON':
+        return f"'{escape(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))}'"
+    return str(value)
+
+
+class SqlBuilder(object):
+    """
+    Build multi-table INSERT statements incrementally into one buffer, cut so that each statement stays within
+    max_bytes of UTF-8.
+    builder = SqlBuilder(65480)
+    builder.add('meter_01', fields, row)
+    builder.add('meter_02', fields, row, 'meters', tags)
+    for sql, rows in builder.statements():
+        ...
+    """
+    _PREFIX = b"INSERT INTO"
+
+    def __init__(self, max_bytes=MAX_SQL_BYTES):
+        self.max_bytes = max_bytes
+        self._statements = []
+        self._buffer = bytearray(self._PREFIX)
+        self._rows = []
+        self._prefixes = {}  # (table, stable) -> b" table" or b" table USING stable TAGS(...)"
+
+    def add(self, table: str, fields: list, arg: dict, stable: str = None, tags: list = None):
+        """
+        append one row of table, with the USING clause to create it when stable is given. The clause is built from
+        the tags of the first row of the table and reused for its other rows. The row is not copied nor modified.
+        :param fields: value fields of the stable
+        :param tags: tag fields of the stable, necessary with stable
+        """
+        prefix = self._prefixes.get((table, stable))
+        if prefix is None:
+            prefix = self._prefixes[(table, stable)] = self._table_prefix(table, arg, stable, tags)
+        buffer = self._buffer
+        start = len(buffer)
+        buffer += prefix
+        buffer += b" VALUES ("
+        self._write_values(buffer, fields, arg)
+        buffer += b")"
+
+        if len(buffer) > self.max_bytes:
+            row = bytes(buffer[start:])
+            del buffer[start:]
+            if len(row) + len(self._PREFIX) > self.max_bytes:
+                raise TDError(f"SQL of one row of '{table}' is {len(row) + len(self._PREFIX)} bytes, "
+                              f"over {self.max_bytes} bytes.")
+            self._cut()
+            self._buffer += row
+        self._rows.append(arg)
+
+    def statements(self):
+        """
+        :return: [(sql, rows)], rows are the rows in the statement
+        """
+        if self._rows:
+            self._cut()
+        return self._statements
+
+    def _cut(self):
+        self._statements.append((self._buffer.decode(), self._rows))
+        self._buffer = bytearray(self._PREFIX)
+        self._rows = []
+
+    @classmethod
+    def _table_prefix(cls, table: str, arg: dict, stable: str = None, tags: list = None):
+        prefix = bytearray(b" ")
+        prefix += table.encode()
+        if stable:
+            prefix += b" USING "
+            prefix += stable.encode()
+            prefix += b" TAGS("
+            if not cls._write_values(prefix, tags, arg):
+                raise TDError(f"参数中没有包含tag，tag字段有：{','.join([tag['Field'] for tag in tags])}")
+            prefix += b")"
+        return bytes(prefix)
+
+    @staticmethod
+    def _write_values(buffer: bytearray, fields: list, arg: dict):
+        """
+        the fields are looked up by their name, then case-insensitively.
+        :return: whether a value is not NULL
+        """
+        not_null = False
+        lowered = None
+        for i, f in enumerate(fields):
+            if i:
+                buffer += b","
+            value = arg.get(f['Field'])
+            if value is None:
+                if lowered is None:
+                    lowered = {str(k).lower(): v for k, v in arg.items()}
+                value = lowered.get(f['Field'])
+            if value is not None:
+                not_null = True
+            buffer += sql_literal(value, f['Type']).encode()
+        return not_null
+
+
 def get_insert_sql(table: str, num_columns: int):
     key = table + "_insert"
     sql = cache.get(key)
@@ -1,39 +1,147 @@
+import re
 import taos
 import logging
+import time
+import threading
 import functools
-from taostd import cache
+from taostd import cache, metrics
 from datetime import datetime, timedelta
-from taostd.model import TDCtx, TDError, Engine, ConnectionCtx, Dict, MultiColumnsError
-from taostd.bind import bind_params, batch_bind_params
-from taostd.sql import get_sql_tags, get_sql_values, get_insert_sql
-from queue import Queue
-import copy
+from concurrent.futures import ThreadPoolExecutor
+from taostd.model import TDCtx, TDError, Engine, ConnectionCtx, Dict, MultiColumnsError, ConnectionPool, \
+    StatementCache, InsertResult, row_class, ROW_METHODS, is_connection_error
+from taostd.bind import Binder, MULTI_BIND
+from taostd.sql import get_sql_tags, get_insert_sql, sql_literal, SqlBuilder, MAX_SQL_BYTES
+from taostd.writer import BufferedWriter, ProcessWriter
+from taostd.lines import MAX_LINES_BYTES, batch_lines
+from taostd.query_cache import QueryCache, normalize
+from taostd.last_row import LastRowStore
 
 # connection pool
 _pool = None
+_WARMUP_MODES = ('eager', 'lazy', 'background')
+# progress of the table meta cache warm-up
+_warmup = {'mode': None, 'state': None, 'stables': 0, 'stables_loaded': 0, 'tables': 0, 'snapshot': 0,
+           'elapsed': 0.0, 'error': None}
+_warmup_done = threading.Event()
+# taostd.snapshot.Snapshot of the table meta cache, None when it is not enabled
+_snapshot = None
+# cached for table_miss_ttl seconds in place of the stable of a table that does not exist
+_TABLE_MISSING = object()
+_table_miss_ttl = 5
+# table names looked up in one query
+_LOOKUP_BATCH = 500
+_max_sql_bytes = MAX_SQL_BYTES
+# schemaless protocols and timestamp precisions of insert_lines
+_SML_PROTOCOLS = {'line': 'LINE_PROTOCOL', 'telnet': 'TELNET_PROTOCOL', 'json': 'JSON_PROTOCOL'}
+_SML_PRECISIONS = {None: 'NOT_CONFIGURED', 'h': 'HOURS', 'm': 'MINUTES', 's': 'SECONDS', 'ms': 'MILLI_SECONDS',
+                   'us': 'MICRO_SECONDS', 'ns': 'NANO_SECONDS'}
+# text SQL insert counters, updated by the threads of parallel_insert under _sql_stats_lock
+_sql_stats = {'calls': 0, 'batches': 0, 'bytes': 0, 'rows': 0}
+_sql_stats_lock = threading.Lock()
 # thread-local context:
 _db_ctx = None
 _tz_offset = None
-
-
-def init_db(database, pool_size=1, tz_offset=8, *args, **kwargs):
+# default row type of select results: 'dict' or 'compact'
+_row_type = 'dict'
+# taostd.query_cache.QueryCache of get, select_one and select, None when it is disabled
+_query_cache = None
+_query_cache_ttl = 0
+# taostd.last_row.LastRowStore fed by the inserts, None when it is disabled
+_last_rows = None
+
+# error number of taos.error.StatementError
+_ERR_TABLE_NOT_EXIST = -2147482782
+_ERR_SCHEMA_VERSION = -2147482108
+
+# column name of select last_row(*): last_row(current)
+_LAST_ROW_NAME = re.compile(r"^last_row\((.*)\)$", re.IGNORECASE)
+# SQL that changes the schema of a table or stable
+_SCHEMA_SQL = re.compile(r"^\s*(?:ALTER|DROP)\s+S?TABLE\s+(?:IF\s+EXISTS\s+)?(?:\w+\.)?(\w+)", re.IGNORECASE)
+
+
+def init_db(database, pool_size=1, tz_offset=8, *args, max_pool_size=None, pool_timeout=None, idle_timeout=300,
+            validate_interval=30, stmt_cache_size=64, row_type='dict', warmup='eager', warmup_page_size=10000,
+            snapshot=None, table_miss_ttl=5, max_sql_bytes=MAX_SQL_BYTES, query_cache_size=1024, query_cache_ttl=0,
+            last_row_tables=0, **kwargs):
+    """
+    init the connection pool and the table meta cache.
+    :param database: database name
+    :param pool_size: connections opened at start, the pool keeps at least pool_size connections
+    :param max_pool_size: the pool grows lazily up to max_pool_size connections, default is pool_size
+    :param pool_timeout: seconds to wait for a connection, None waits forever. model.PoolTimeoutError on timeout
+    :param idle_timeout: seconds after which idle connections over pool_size are closed, None keeps them
+    :param validate_interval: a connection idle for validate_interval seconds is validated on checkout and
+                              reconnected when it is broken, None disables validation
+    :param tz_offset: hours of the local time zone, naive datetime is shifted to UTC by it
+    :param stmt_cache_size: prepared statements kept for reuse on each pooled connection
+    :param row_type: default row type of select results, 'dict': taostd.model.Dict, 'compact': taostd.model.Row
+    :param warmup: how the table meta cache is loaded. 'eager': all stables and tables before init_db returns,
+                   'lazy': each table and stable on first use, 'background': a thread loads the tables of each
+                   stable in pages of warmup_page_size while the ones not loaded yet are looked up on demand.
+                   See warmup_stats() and wait_warmup()
+    :param snapshot: path of a local sqlite file that keeps the table meta cache across restarts. When it holds
+                     a snapshot of the database, the cache is loaded from it and reconciled with the server in
+                     the background whatever warmup is, otherwise the warm-up fills it
+    :param table_miss_ttl: seconds a table that does not exist is remembered, so inserting into it does not look
+                           it up again. It is forgotten at once when taostd creates the table. 0 disables it
+    :param max_sql_bytes: text INSERT statements are cut to stay within max_sql_bytes, the maxSQLLength of the server
+    :param query_cache_size: results of get, select_one and select kept in the query cache, 0 disables it
+    :param query_cache_ttl: seconds the results are cached when the call gives no ttl, 0 caches only the calls with
+                            a ttl. The entries of a table or stable are invalidated when taostd inserts into it
+    :param last_row_tables: tables whose last inserted row is kept in memory for last_row() and stable_last_row(),
+                            the least recently used ones are evicted beyond it. 0 disables it
+    :param kwargs: other parameters of taos.connect()
+    """
     global _pool
     global _db_ctx
     global _tz_offset
-    _tz_offset = tz_offset
+    global _row_type
+    global _snapshot
+    global _table_miss_ttl
+    global _max_sql_bytes
+    global _query_cache
+    global _query_cache_ttl
+    global _last_rows
     if _pool is not None:
         raise TDError('DB is already initialized.')
+    if warmup not in _WARMUP_MODES:
+        raise TDError(f"Invalid warmup '{warmup}', expect one of {_WARMUP_MODES}.")
+    _row_factory([], row_type)
+    _tz_offset = tz_offset
+    _row_type = row_type
+    _table_miss_ttl = table_miss_ttl
+    _max_sql_bytes = max_sql_bytes
+    _query_cache = QueryCache(query_cache_size) if query_cache_size else None
+    _query_cache_ttl = query_cache_ttl
+    _last_rows = LastRowStore(last_row_tables, tz_offset) if last_row_tables else None
 
     kwargs['database'] = database
     engine = Engine(lambda: taos.connect(*args, **kwargs))
-    _pool = Queue(maxsize=pool_size)
-    for _ in range(pool_size):
-        _pool.put_nowait(engine.connect())
+    _pool = ConnectionPool(engine, min_size=pool_size, max_size=max_pool_size, timeout=pool_timeout,
+                           idle_timeout=idle_timeout, validate_interval=validate_interval,
+                           stmt_cache_size=stmt_cache_size)
     _db_ctx = TDCtx(_pool)
     # examples connection...
     logging.info('Init TDengine engine <%s> ok.' % hex(id(engine)))
 
-    _init_table_cache()
+    _warmup.update(mode=warmup, state='pending')
+    if snapshot:
+        from taostd.snapshot import Snapshot
+        _snapshot = Snapshot(snapshot, database)
+        known_stables, known_tables = _load_snapshot()
+        if known_stables:
+            threading.Thread(target=_background_warmup, args=(warmup_page_size, known_stables, known_tables),
+                             name='taostd-warmup', daemon=True).start()
+            return
+
+    if warmup == 'eager':
+        _init_table_cache()
+    elif warmup == 'background':
+        threading.Thread(target=_background_warmup, args=(warmup_page_size,), name='taostd-warmup',
+                         daemon=True).start()
+    else:
+        _warmup['state'] = 'done'
+        _warmup_done.set()
 
 
 def connection():
@@ -65,14 +173,53 @@ def with_connection(func):
     return _wrapper
 
 
-@with_connection
-def get(sql: str):
+def _writes(tables_of, rows_of=None):
+    """
+    Decorator of the functions that write to the tables tables_of(*args, **kw), None is all the tables:
+    the query cache entries reading from the tables or their stables are invalidated after the call.
+    rows_of(*args, **kw) are the (table, row) written, they feed the last-row store when the call succeeds,
+    the tables of a failed call or without rows_of are dropped from it. An error updating the caches after a
+    successful call is logged and clears the last-row store, the result of the call is returned.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kw):
+            try:
+                result = func(*args, **kw)
+            except BaseException:
+                if _last_rows is not None or (_query_cache is not None and _query_cache.watching):
+                    _after_write(tables_of(*args, **kw))
+                raise
+            if _last_rows is not None or (_query_cache is not None and _query_cache.watching):
+                try:
+                    rows = rows_of(*args, **kw) if rows_of and _last_rows is not None else None
+                    _after_write(tables_of(*args, **kw), rows, getattr(result, 'rejected', ()))
+                except Exception:
+                    # the rows are written, a stale last row is not kept
+                    logging.exception(f"Update the caches after {func.__name__} error.")
+                    if _last_rows is not None:
+                        _last_rows.clear()
+            return result
+
+        return _wrapper
+
+    return decorator
+
+
+def get(sql: str, ttl=None):
     """ execute select SQL and return unique result.
         select count(1) form meters
         or
         select lass(ts) from meters where tag = 'xxx'
+        :param ttl: seconds the result is cached, default is the query_cache_ttl of init_db, 0 does not cache
         :return: only value
     """
+    return _cached('get', sql, ttl, lambda: _get(sql))
+
+
+@with_connection
+def _get(sql: str):
     result = _query(sql)
     try:
         value = result.next()
@@ -86,25 +233,144 @@ def get(sql: str):
         raise MultiColumnsError('Expect only one column.')
 
 
-@with_connection
-def select_one(sql: str):
+def select_one(sql: str, row_type=None, ttl=None):
     """ execute select SQL and return unique result.
         select last_row(*) from meters where tag = 'xxx';
+        :param row_type: 'dict' or 'compact', default is the row_type of init_db
+        :param ttl: seconds the result is cached like get, a cached row is shared by the callers
         :return: {k:v}
     """
-    result = _select(sql)
+    return _cached(('select_one', row_type or _row_type), sql, ttl, lambda: _select_one(sql, row_type))
+
+
+@with_connection
+def _select_one(sql: str, row_type=None):
+    result = _select(sql, row_type)
     if result:
         return result[0]
     else:
         return None
 
 
+def select(sql: str, row_type=None, ttl=None):
+    """ execute select SQL and return list results.
+        :param row_type: 'dict': rows are taostd.model.Dict, 'compact': rows are taostd.model.Row tuples which take
+                         less memory and also support row.x and row['x'], Dict when a field is named get, keys,
+                         values or items. default is the row_type of init_db
+        :param ttl: seconds the result is cached like get, the cached rows are shared by the callers
+    """
+    if _query_cache is None or not (_query_cache_ttl if ttl is None else ttl):
+        return _select_rows(sql, row_type)
+    return list(_cached(('select', row_type or _row_type), sql, ttl, lambda: _select_rows(sql, row_type)))
+
+
 @with_connection
-def select(sql: str):
-    """ execute select SQL and return list results."""
-    return _select(sql)
+def _select_rows(sql: str, row_type=None):
+    return _select(sql, row_type)
+
+
+def iter_select(sql: str, chunk_size=None, row_type=None):
+    """ execute select SQL and yield the results block by block instead of loading them all.
+        The pool connection is checked out at the first iteration and released when the generator is exhausted,
+        closed or garbage collected; inside 'with connection()' the connection of the current thread is used.
+        While iterating, the calls of the thread, such as inserting the rows read, use the same connection, so
+        iterating needs no second pooled connection. Finish the iteration in the thread that started it.
+        for row in iter_select("select * from meters"):
+            pass
+        :param chunk_size: yield lists of up to chunk_size rows instead of single rows
+        :param row_type: 'dict' or 'compact', default is the row_type of init_db
+    """
+    chunk = []
+    make_row = None
+    for fields, block in _iter_blocks(sql, lambda result, fields: result.fetch_block()[0]):
+        if make_row is None:
+            make_row = _row_factory(fields, row_type)
+        if chunk_size:
+            chunk.extend(make_row(x) for x in block)
+            while len(chunk) >= chunk_size:
+                yield chunk[:chunk_size]
+                chunk = chunk[chunk_size:]
+        else:
+            for x in block:
+                yield make_row(x)
+    if chunk:
+        yield chunk
+
+
+def select_columns(sql: str, as_numpy=False, datetime64=False):
+    """ execute select SQL and return the results as one list, or NumPy array, per field.
+        TIMESTAMP columns are the int64 epoch in the precision of the database, or datetime64 with as_numpy and
+        datetime64.
+        :return: {field: [values]}
+    """
+    from taostd.columns import concat_columns, empty_columns
+
+    blocks = []
+    empty = lambda result, fields: empty_columns(result, fields, as_numpy, datetime64)
+    for _, block in _iter_blocks(sql, _column_reader(as_numpy, datetime64), empty_columns=empty):
+        blocks.append(block)
+    return Dict(**concat_columns(blocks, as_numpy))
+
+
+def iter_select_columns(sql: str, as_numpy=False, datetime64=False):
+    """ execute select SQL and yield the results block by block, each block as one list or NumPy array per field.
+        The pool connection is held like iter_select.
+    """
+    for _, block in _iter_blocks(sql, _column_reader(as_numpy, datetime64)):
+        yield Dict(**block)
+
+
+def _column_reader(as_numpy, datetime64):
+    from taostd.columns import fetch_columns
 
+    return lambda result, fields: fetch_columns(result, fields, as_numpy, datetime64)
 
+
+def _iter_blocks(sql: str, read_block, empty_columns=None):
+    """
+    yield (field names, read_block(result, field names)) until read_block raises StopIteration.
+    empty_columns(result, field names) is yielded instead when the result has no rows.
+    """
+    global _db_ctx
+    ctx = _db_ctx
+    if not ctx.is_init():
+        # bound to the thread, so the calls made while iterating reuse it
+        ctx.init()
+        ctx.connection.release_after_iterations = True
+    conn = ctx.connection
+    conn.iterations += 1
+    result = None
+    broken = False
+    try:
+        logging.debug('SQL: %s' % sql)
+        result = conn.query(sql)
+        fields = [field['name'] for field in result.fields]
+        empty = True
+        while True:
+            try:
+                block = read_block(result, fields)
+            except StopIteration:
+                break
+            empty = False
+            yield fields, block
+        if empty and empty_columns:
+            yield fields, empty_columns(result, fields)
+    except Exception as err:
+        broken = is_connection_error(err)
+        raise
+    finally:
+        if result is not None:
+            result.close()
+        conn.iterations -= 1
+        if conn.iterations == 0 and conn.release_after_iterations:
+            conn.release_after_iterations = False
+            if ctx.connection is conn:
+                ctx.cleanup(broken)
+            else:
+                ctx.pool.release(conn, broken)
+
+
+@_writes(lambda sql, *args, **kw: () if sql.lstrip()[:6].lower() == 'select' else None)
 @with_connection
 def execute(sql: str, params=None) -> int:
     """
@@ -117,10 +383,16 @@ def execute(sql: str, params=None) -> int:
     logging.debug('SQL: %s' % sql)
     if params:
         return _stmt_execute(sql, params)
-    else:
-        return _cursor_execute(sql)
+
+    affected_rows = _cursor_execute(sql)
+    matched = _SCHEMA_SQL.match(sql)
+    if matched:
+        _forget(matched.group(1))
+        StatementCache.invalidate()
+    return affected_rows
 
 
+@_writes(lambda table, *args, **kw: (table,), lambda table, **row: ((table, row),))
 @with_connection
 def insert_one(table: str, **kwargs):
     """
@@ -136,6 +408,7 @@ def insert_one(table: str, **kwargs):
     return _insert_one(table, cache_stable, **kwargs)
 
 
+@_writes(lambda table, *args, **kw: (table,), lambda table, stable, **row: ((table, row),))
 @with_connection
 def insert_one_with_stable(table: str, stable: str, **kwargs):
     """
@@ -145,12 +418,11 @@ def insert_one_with_stable(table: str, stable: str, **kwargs):
     :param kwargs: values: {field: value}, tags are not necessary
     :return: affected_rows
     """
-    global _tz_offset
     cache_stable = _get_table_cache(table)
     if cache_stable is None:
         desc = _get_stable_cache(stable)
         num_columns = desc['columns']
-        params = bind_params(num_columns, _tz_offset, desc['fields'], **kwargs)
+        params = desc['binder'].bind(kwargs)
         return _insert_one_with_stable(table, stable, num_columns, desc, params, **kwargs)
     elif cache_stable != stable:
         raise TDError(f"expect stable '{cache_stable}'，but input '{stable}'.")
@@ -158,6 +430,7 @@ def insert_one_with_stable(table: str, stable: str, **kwargs):
         return _insert_one(table, cache_stable, **kwargs)
 
 
+@_writes(lambda table, *args, **kw: (table,), lambda table, args, *_, **kw: ((table, row) for row in args))
 @with_connection
 def insert_many(table: str, args: list, batch_size=100):
     """
@@ -165,7 +438,7 @@ def insert_many(table: str, args: list, batch_size=100):
     :param table:
     :param args: [{"ts": xxx, ...}, {}]
     :param batch_size:
-    :return: affected_rows
+    :return: InsertResult, affected_rows and the rejected rows of the batches that failed
     """
     cache_stable = _get_table_cache(table)
     if cache_stable is None:
@@ -174,6 +447,8 @@ def insert_many(table: str, args: list, batch_size=100):
     return _insert_many(table, cache_stable, args, batch_size=batch_size)
 
 
+@_writes(lambda table, *args, **kw: (table,),
+         lambda table, stable, args, *_, **kw: ((table, row) for row in args))
 @with_connection
 def insert_many_with_stable(table: str, stable: str, args: list, batch_size=100):
     """
@@ -182,114 +457,572 @@ def insert_many_with_stable(table: str, stable: str, args: list, batch_size=100)
     :param stable: stable name
     :param args: [{"ts": xxx, ...}, {}]
     :param batch_size:
-    :return: affected_rows
+    :return: InsertResult, affected_rows and the rejected rows of the batches that failed
     """
     cache_stable = _get_table_cache(table)
     if cache_stable is None:  # table未创建，需要点指定stable
+        if not args:
+            return InsertResult()
         desc = _get_stable_cache(stable)
         num_columns = desc['columns']
-        tags = [f for f in desc['fields'] if f['Note'] == "TAG"]
+        tags = desc['tag_fields']
         tag_sql_values = get_sql_tags(tags, **(args[0]))
         sql = f"INSERT INTO {table} USING {stable} TAGS({tag_sql_values}) VALUES ({','.join(['?' for i in range(num_columns)])})"
         logging.debug('SQL: %s' % sql)
 
-        if args:
-            affected_rows = 0
-            length = len(args)
-            if length <= batch_size:
-                affected_rows = _batch_stmt_execute(sql, num_columns, desc['fields'], args)
-            else:
-                affected_rows = 0
-                batches = length // batch_size + 1
-                for i in range(batches):
-                    start = i * batch_size
-                    end = start + batch_size
-                    try:
-                        affected_rows += _batch_stmt_execute(sql, num_columns, desc['fields'], args[start:end])
-                    except:
-                        logging.error(f"execute {i} batch error.")
-            cache.set(table, stable)
-            return affected_rows
-        else:
-            return 0
+        result = _insert_batches(lambda rows: _batch_stmt_execute(sql, desc['binder'], rows), args, batch_size)
+        if result:
+            _set_table_cache(table, stable)
+        return result
     elif cache_stable != stable:
         raise TDError(f"expect stable '{cache_stable}'，but input '{stable}'.")
     else:  # table已创建， 直接插入VALUES
-        return _insert_many(table, stable, args)
+        return _insert_many(table, stable, args, batch_size=batch_size)
 
 
+@_writes(lambda table, *args, **kw: (table,))
+@with_connection
+def insert_dataframe(table: str, df, stable: str = None, tag_columns=None, batch_size=1000):
+    """
+    insert the rows of a pandas DataFrame, or a dict of NumPy arrays, into table, and create it if the table does
+    not exit. Columns are bound as whole buffers, datetime64 columns are converted to epoch in one vectorized step.
+    :param table: table name
+    :param df: DataFrame or {name: numpy array}, columns are matched to the fields of the stable
+    :param stable: stable name, necessary when the table does not exit
+    :param tag_columns: columns holding the tags of the table, the first row is used when creating the table.
+                        default: the tags of the stable found in df
+    :param batch_size:
+    :return: affected_rows
+    """
+    from taostd.frame import frame_columns, frame_length, frame_row, bind_frame
+
+    global _tz_offset
+    if not MULTI_BIND:
+        raise TDError("insert_dataframe needs the multi-bind API of taospy.")
+
+    cache_stable = _get_table_cache(table)
+    if cache_stable is None and stable is None:
+        raise TDError(f"Table '{table}' does not exist, please add stable")
+    elif cache_stable and stable and cache_stable != stable:
+        raise TDError(f"expect stable '{cache_stable}'，but input '{stable}'.")
+
+    stable = cache_stable or stable
+    desc = _get_stable_cache(stable)
+    num_columns = desc['columns']
+    length = frame_length(df)
+    if length == 0:
+        return 0
+
+    columns = frame_columns(desc['fields'], df, _tz_offset)
+    if tag_columns is None:
+        tag_names = [f['Field'] for f in desc['fields'] if f['Note'] == "TAG"]
+        tag_columns = [name for name in (df.columns if hasattr(df, 'columns') else df.keys())
+                       if str(name).lower() in tag_names]
+
+    def create_sql():
+        tags = desc['tag_fields']
+        tag_sql_values = get_sql_tags(tags, **frame_row(df, tag_columns))
+        return f"INSERT INTO {table} USING {stable} TAGS({tag_sql_values}) VALUES ({','.join(['?' for _ in range(num_columns)])})"
+
+    sql = get_insert_sql(table, num_columns) if cache_stable else create_sql()
+    logging.debug('SQL: %s' % sql)
+    affected_rows = 0
+    for start in range(0, length, batch_size):
+        binds = bind_frame(columns, start, start + batch_size)
+        try:
+            affected_rows += _stmt_execute(sql, binds, multi=True)
+        except taos.error.StatementError as err:
+            logging.warning(f"'{table}' {err.msg}")
+            if err.errno != _ERR_TABLE_NOT_EXIST or not tag_columns:
+                raise err
+            _forget(table)
+            sql = create_sql()
+            logging.debug('SQL: %s' % sql)
+            affected_rows += _stmt_execute(sql, binds, multi=True)
+            cache_stable = None
+    if cache_stable is None:
+        _set_table_cache(table, stable)
+    return affected_rows
+
+
+@_writes(lambda args, *_, **kw: [arg.get("table") for arg in args],
+         lambda args, *_, **kw: ((arg.get("table"), arg) for arg in args))
 @with_connection
 def insert_many_tables(args: list, batch_size=100):
     """
     insert many lows into each table, and create it if the table does exit.
+    rows are bound on one prepared statement per stable, the rows are not modified.
     :param args: [{"table": xxx, ["stable": xxx,] “ts”: "2021-01-01 00:22:44.000"...}, {}]
     :param batch_size:
+    :return: InsertResult, affected_rows and the rejected rows of the batches that failed
+    """
+    rejected = []
+    return _insert_batches(lambda rows: _insert_many_tables(rows, rejected), args, batch_size, rejected)
+
+
+@_writes(lambda *args, **kw: None)
+@with_connection
+def insert_lines(lines: list, protocol='line', precision='ms', max_bytes=MAX_LINES_BYTES):
+    """
+    schemaless insert: the server creates the stables, tables, tags and columns of the lines by itself.
+    td.insert_lines(["meters,location=北京,groupid=2 current=10.3,voltage=219i32,phase=0.31 1648432611249"])
+    :param lines: lines of the protocol, see to_lines()
+    :param protocol: 'line': InfluxDB line protocol, 'telnet': OpenTSDB telnet, 'json': OpenTSDB JSON
+    :param precision: precision of the timestamps of line protocol: 'h', 'm', 's', 'ms', 'us', 'ns',
+                      None for the OpenTSDB protocols
+    :param max_bytes: lines are inserted in batches of at most max_bytes
     :return: affected_rows
     """
-    if args:
-        length = len(args)
-        if length <= batch_size:
-            return _insert_many_tables(args)
-        else:
-            affected_rows = 0
-            batches = length // batch_size + 1
-            for i in range(batches):
-                start = i * batch_size
-                end = start + batch_size
-                try:
-                    affected_rows += _insert_many_tables(args[start:end])
-                except:
-                    logging.error(f"execute {i} batch error.")
-            return affected_rows
-    else:
-        return 0
+    global _db_ctx
+    if protocol not in _SML_PROTOCOLS:
+        raise TDError(f"Invalid protocol '{protocol}', expect one of {tuple(_SML_PROTOCOLS)}.")
+    if precision not in _SML_PRECISIONS:
+        raise TDError(f"Invalid precision '{precision}', expect one of {tuple(_SML_PRECISIONS)}.")
+    sml_protocol = getattr(taos.SmlProtocol, _SML_PROTOCOLS[protocol])
+    sml_precision = getattr(taos.SmlPrecision, _SML_PRECISIONS[precision if protocol == 'line' else None])
+
+    affected_rows = 0
+    for batch in batch_lines(lines, max_bytes):
+        logging.debug(f"schemaless insert {len(batch)} lines")
+        result = _db_ctx.connection.schemaless_insert(batch, sml_protocol, sml_precision)
+        affected_rows += result if isinstance(result, int) else len(batch)
+    return affected_rows
 
 
+@with_connection
+def to_lines(args: list, precision='ms', table_tag=None):
+    """
+    serialize rows like the ones of insert_many_tables into InfluxDB line protocol for insert_lines.
+    The tags and the column types are the ones of the stable when it exists, otherwise str values are tags.
+    :param args: [{"stable": xxx, ["table": xxx,] “ts”: "2021-01-01 00:22:44.000"...}, {}]
+    :param precision: precision of the timestamps, the same as the one of insert_lines
+    :param table_tag: tag holding the table name, it must be smlChildTableName of the server
+    :return: [line]
+    """
+    from taostd.lines import to_lines as _to_lines
+
+    global _tz_offset
+    stables = {}
+    for arg in args:
+        stable = arg.get("stable")
+        if stable and stable not in stables:
+            try:
+                desc = _get_stable_cache(stable)
+            except TDError:
+                stables[stable] = None
+                continue
+            stables[stable] = {f['Field']: (f['Type'], f['Note'] == "TAG") for f in desc['fields']}
+    return _to_lines(args, stables, _tz_offset, precision, table_tag=table_tag)
+
+
+def parallel_insert(args: list, workers=None, batch_size=1000):
+    """
+    insert the rows of many tables concurrently, each worker thread checks out its own pooled connection.
+    The rows are partitioned by table, so the rows of a table are inserted in order by one worker.
+    :param args: [{"table": xxx, ["stable": xxx,] “ts”: "2021-01-01 00:22:44.000"...}, {}], like insert_many_tables
+    :param workers: threads, default is max_pool_size
+    :param batch_size: rows inserted at once
+    :return: InsertResult, affected_rows and the rows that could not be inserted
+    """
+    global _pool
+    if not args:
+        return InsertResult()
+    workers = workers or _pool.max_size
+    tables = {}
+    for arg in args:
+        table = arg.get("table")
+        if table is None:
+            raise TDError("'table' is expected.")
+        tables.setdefault(table, []).append(arg)
+
+    # the biggest tables first, each one to the partition with the fewest rows
+    partitions = [[] for _ in range(min(workers, len(tables)))]
+    sizes = [0] * len(partitions)
+    for table, rows in sorted(tables.items(), key=lambda item: len(item[1]), reverse=True):
+        i = sizes.index(min(sizes))
+        partitions[i].extend(rows)
+        sizes[i] += len(rows)
+
+    affected_rows = 0
+    rejected = []
+    with ThreadPoolExecutor(max_workers=len(partitions), thread_name_prefix='taostd-insert') as executor:
+        for result in executor.map(lambda rows: insert_many_tables(rows, batch_size), partitions):
+            affected_rows += result
+            rejected.extend(result.rejected)
+    return InsertResult(affected_rows, rejected)
+
+
+@_writes(lambda table, *args, **kw: (table,))
 @with_connection
 def drop_table(table: str):
     _cursor_execute(f"DROP TABLE IF EXISTS {table}")
-    cache.delete(table)
+    _forget(table)
+    StatementCache.invalidate()
+
+
+def pool_stats():
+    """
+    connection pool size and checkout metrics: wait count and time, timeouts, reconnects.
+    """
+    global _pool
+    return _pool.stats()
+
+
+def warmup_stats():
+    """
+    progress of the table meta cache warm-up: state is 'pending', 'running', 'done' or 'failed',
+    stables_loaded of stables have their tables loaded, elapsed is in seconds.
+    """
+    return dict(_warmup)
+
+
+def wait_warmup(timeout=None):
+    """
+    wait until the table meta cache warm-up ends, return False on timeout.
+    """
+    return _warmup_done.wait(timeout)
+
+
+def sql_batch_stats():
+    """
+    text SQL insert counters: statements per call and bytes per statement.
+    """
+    with _sql_stats_lock:
+        stats = dict(_sql_stats)
+    stats['batches_per_call'] = stats['batches'] / stats['calls'] if stats['calls'] else 0
+    stats['bytes_per_batch'] = stats['bytes'] / stats['batches'] if stats['batches'] else 0
+    return stats
+
+
+def stmt_cache_stats():
+    """
+    prepared statement cache counters of all the pooled connections.
+    :return: {'hits': int, 'misses': int, 'evictions': int, 'size': int}
+    """
+    stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0}
+    for conn in _pool.connections:
+        stats['hits'] += conn.statements.hits
+        stats['misses'] += conn.statements.misses
+        stats['evictions'] += conn.statements.evictions
+        stats['size'] += len(conn.statements)
+    return stats
+
+
+def query_cache_stats():
+    """
+    query cache counters, coalesced are the calls that waited for an identical query in flight.
+    :return: {'hits': int, 'misses': int, 'coalesced': int, 'invalidations': int, 'size': int}, None when disabled
+    """
+    global _query_cache
+    return _query_cache.stats() if _query_cache is not None else None
+
+
+def clear_query_cache():
+    global _query_cache
+    if _query_cache is not None:
+        _query_cache.clear()
+
+
+def last_row(table: str):
+    """
+    the last row inserted into table by taostd, from the last-row store of init_db(last_row_tables=...).
+    On a miss, or when the store is disabled, it is selected by last_row(*) from the server and stored.
+    :return: {column: value}, the values of a stored row are the ones that were inserted, None when table is empty
+    """
+    global _last_rows
+    if _last_rows is not None:
+        row = _last_rows.get(table)
+        if row is not None:
+            metrics.count('last_row_hit')
+            return Dict(**row)
+        metrics.count('last_row_miss')
+    row = _select_last_row(f"select last_row(*) from {table}")
+    if row is not None and _last_rows is not None:
+        _last_rows.update(_last_row_items([(table, row)], ()))
+    return row
+
+
+def stable_last_row(stable: str, tag=None, value=None):
+    """
+    the newest row of the tables of stable, or of its tables whose tag is value, from the last-row store when one
+    of its tables holds it, otherwise selected by last_row(*) from the server.
+    :return: {column: value}, None when there is no row
+    """
+    global _last_rows
+    if _last_rows is not None:
+        latest = _last_rows.get_latest(stable, tag, value)
+        if latest is not None:
+            metrics.count('last_row_hit')
+            return Dict(**latest[1])
+        metrics.count('last_row_miss')
+    sql = f"select last_row(*) from {stable}"
+    if tag:
+        desc = _get_stable_cache(stable)
+        types = {f['Field']: f['Type'] for f in desc['fields'] if f['Note'] == "TAG"}
+        if tag.lower() not in types:
+            raise TDError(f"Stable '{stable}' has no tag '{tag}'.")
+        sql += f" where {tag} = {sql_literal(value, types[tag.lower()])}"
+    return _select_last_row(sql)
+
+
+def last_row_stats():
+    """
+    :return: {'hits': int, 'misses': int, 'evictions': int, 'tables': int}, None when the store is disabled
+    """
+    global _last_rows
+    return _last_rows.stats() if _last_rows is not None else None
+
+
+@with_connection
+def _select_last_row(sql: str):
+    result = _query(sql)
+    names = [_LAST_ROW_NAME.sub(r'\1', field['name']) for field in result.fields]
+    for values in result:
+        if any(v is not None for v in values):
+            return Dict(names, values)
+    return None
 
 
 @with_connection
 def _init_table_cache():
     logging.info("Init table meta cache")
-    stables = _select("show stables")
+    start = time.monotonic()
+    _warmup['state'] = 'running'
+    try:
+        stables = _init_stable_cache()
+        tables = _select("show tables", 'dict')
+        for tbl in tables:
+            cache.set(tbl['table_name'], tbl['stable_name'])
+        _snapshot_call('put_tables', [(tbl['table_name'], tbl['stable_name']) for tbl in tables])
+        _snapshot_call('mark_reconciled')
+    except Exception as err:
+        _warmup.update(state='failed', error=str(err), elapsed=time.monotonic() - start)
+        raise
+    finally:
+        _warmup_done.set()
+    _warmup.update(state='done', stables_loaded=len(stables), tables=len(tables), elapsed=time.monotonic() - start)
+    logging.info(f"Init table meta cache: {len(stables)} stables, {len(tables)} tables in {_warmup['elapsed']:.3f}s")
+
+
+def _init_stable_cache():
+    stables = _select("show stables", 'dict')
+    _warmup['stables'] = len(stables)
     for stbl in stables:
-        fields = _select(f"describe {stbl['name']}")
-        fields = [_del_field_length(f) for f in fields]
-        cache.set(stbl['name'], {'columns': stbl['columns'], 'tags': stbl['tags'], 'fields': fields})
+        fields = _select(f"describe {stbl['name']}", 'dict')
+        _set_stable_cache(stbl, fields)
+    return stables
 
-    tables = _select("show tables")
-    for tbl in tables:
-        cache.set(tbl['table_name'], tbl['stable_name'])
+
+def _background_warmup(page_size, known_stables=None, known=None):
+    """
+    load the tables of each stable page by page, a connection is only held for one page at a time so the
+    warm-up does not starve the pool. Tables set meanwhile by inserts are kept.
+    :param known_stables: stables loaded from the snapshot
+    :param known: {table: stable} loaded from the snapshot, the tables and stables no longer on the server are removed
+    """
+    start = time.monotonic()
+    _warmup['state'] = 'running'
+    try:
+        with connection():
+            stables = _init_stable_cache()
+        if known_stables:
+            names = {stbl['name'] for stbl in stables}
+            _forget([stable for stable in known_stables if stable not in names])
+        for stbl in stables:
+            offset = 0
+            seen = set()
+            while True:
+                with connection():
+                    rows = _select(f"select tbname from {stbl['name']} limit {page_size} offset {offset}", 'dict')
+                for row in rows:
+                    if cache.get(row['tbname']) in (None, _TABLE_MISSING):
+                        cache.set(row['tbname'], stbl['name'])
+                    seen.add(row['tbname'])
+                _snapshot_call('put_tables', [(row['tbname'], stbl['name']) for row in rows
+                                              if known is None or known.get(row['tbname']) != stbl['name']])
+                offset += len(rows)
+                _warmup.update(tables=_warmup['tables'] + len(rows), elapsed=time.monotonic() - start)
+                if len(rows) < page_size:
+                    break
+            if known:
+                _forget([table for table, stable in known.items() if stable == stbl['name'] and table not in seen])
+            _warmup['stables_loaded'] += 1
+            logging.info(f"Warm up stable '{stbl['name']}': {offset} tables, "
+                         f"{_warmup['stables_loaded']}/{len(stables)} stables in {time.monotonic() - start:.3f}s")
+    except Exception as err:
+        _warmup.update(state='failed', error=str(err), elapsed=time.monotonic() - start)
+        logging.exception("Warm up table meta cache error.")
+    else:
+        _snapshot_call('mark_reconciled')
+        _warmup.update(state='done', elapsed=time.monotonic() - start)
+        logging.info(f"Warm up table meta cache: {_warmup['tables']} tables in {_warmup['elapsed']:.3f}s")
+    finally:
+        _warmup_done.set()
+
+
+def _load_snapshot():
+    """
+    fill the table meta cache from the snapshot.
+    :return: stables, {table: stable} loaded
+    """
+    start = time.monotonic()
+    try:
+        stables, tables = _snapshot.load()
+    except Exception as err:
+        logging.warning(f"Load meta snapshot '{_snapshot.path}' error: {err}")
+        return [], {}
+    for stable, (stbl, fields) in stables.items():
+        cache.set(stable, _new_stable_desc(stbl, fields))
+    for table, stable in tables.items():
+        cache.set(table, stable)
+    _warmup['snapshot'] = len(tables)
+    logging.info(f"Load meta snapshot '{_snapshot.path}': {len(stables)} stables, {len(tables)} tables "
+                 f"in {time.monotonic() - start:.3f}s")
+    return list(stables), tables
+
+
+def _snapshot_call(method, *args):
+    """
+    write to the snapshot when it is enabled. The snapshot is only a hint for the next start, so its errors are
+    logged and never fail the caller.
+    """
+    if _snapshot is None:
+        return
+    try:
+        getattr(_snapshot, method)(*args)
+    except Exception as err:
+        logging.warning(f"Meta snapshot {method} error: {err}")
+
+
+def _set_table_cache(table, stable):
+    cache.set(table, stable)
+    _snapshot_call('put_tables', [(table, stable)])
+
+
+def _set_stable_cache(stbl, fields):
+    desc = _new_stable_desc(stbl, fields)
+    cache.set(stbl['name'], desc)
+    _snapshot_call('put_stable', stbl, fields)
+    return desc
+
+
+def _forget(names):
+    """
+    remove stale tables or stables from the cache and the snapshot.
+    """
+    if isinstance(names, str):
+        names = [names]
+    for name in names:
+        cache.delete(name)
+    _snapshot_call('delete', names)
+
+
+def _cached(kind, sql: str, ttl, query):
+    """
+    query() cached by the query cache for ttl seconds, default is query_cache_ttl.
+    """
+    global _query_cache
+    if ttl is None:
+        ttl = _query_cache_ttl
+    if _query_cache is None or not ttl:
+        return query()
+    normalized = normalize(sql)
+    return _query_cache.get((kind, normalized), normalized, ttl, query)
+
+
+def _after_write(tables, rows=None, rejected=()):
+    """
+    invalidate the query cache entries of tables and of their stables, all of them when tables is None.
+    store the last rows of rows in the last-row store except the rejected ones, drop tables from it when rows is
+    None.
+    """
+    global _query_cache
+    global _last_rows
+    if _query_cache is not None and _query_cache.watching:
+        if tables is None:
+            _query_cache.clear()
+        else:
+            names = set()
+            for table in tables:
+                if table:
+                    names.add(table.lower())
+                    stable = cache.get(table)
+                    if isinstance(stable, str):
+                        names.add(stable.lower())
+            _query_cache.invalidate(names)
+    if _last_rows is not None:
+        if tables is None:
+            _last_rows.clear()
+        elif rows is None:
+            _last_rows.discard(tables)
+        else:
+            _last_rows.update(_last_row_items(rows, rejected))
+
+
+def _last_row_items(rows, rejected):
+    """
+    (table, stable, names, row) of the rows whose table and stable are cached.
+    """
+    skip = {id(row) for row, _ in rejected}
+    layouts = {}  # table -> (stable, names) or None
+    for table, row in rows:
+        if id(row) in skip:
+            continue
+        layout = layouts.get(table, False)
+        if layout is False:
+            stable = cache.get(table) if table else None
+            desc = cache.get(stable) if isinstance(stable, str) else None
+            layout = layouts[table] = (stable, desc['names']) if desc else None
+        if layout is not None:
+            yield table, layout[0], layout[1], row
 
 
 def _query(sql: str):
     global _db_ctx
     logging.debug('SQL: %s' % sql)
-    return _db_ctx.connection.query(sql)
+    start = metrics.start()
+    result = _db_ctx.connection.query(sql)
+    metrics.timing('query', start, nbytes=len(sql))
+    return result
 
 
-def _stmt_execute(sql: str, args):
+def _stmt_execute(sql: str, args, multi=False):
     """
-    :return: TaosResult
+    execute on the statement cached for sql, which is discarded when it fails.
+    :param multi: args is a TaosMultiBind array that binds all rows at once
+    :return: affected_rows
     """
     global _db_ctx
-    stmt = None
+    stmt = _db_ctx.statement(sql)
     try:
-        stmt = _db_ctx.statement(sql)
-        if isinstance(args, list):
+        if multi:
+            stmt.bind_param_batch(args)
+        elif isinstance(args, list):
             for arg in args:
                 stmt.bind_param(arg)
         else:
             stmt.bind_param(args)
 
+        start = metrics.start()
         stmt.execute()
-        return stmt.use_result()
+        affected_rows = _stmt_affected_rows(stmt)
+        metrics.timing('stmt_execute', start, affected_rows)
+        return affected_rows
+    except Exception:
+        _db_ctx.connection.statements.discard(sql)
+        raise
+
+
+def _stmt_affected_rows(stmt):
+    """
+    affected rows of the last execute of stmt. Its result belongs to the statement, which frees it on the next
+    execute or on close, so the result is closed at once and the cached statement can be executed again.
+    """
+    result = stmt.use_result()
+    try:
+        return result.affected_rows
     finally:
-        if stmt:
-            stmt.close()
+        result.close()
 
 
 def _cursor_execute(sql: str):
@@ -297,7 +1030,10 @@ def _cursor_execute(sql: str):
     cursor = None
     try:
         cursor = _db_ctx.cursor()
-        return cursor.execute(sql)
+        start = metrics.start()
+        affected_rows = cursor.execute(sql)
+        metrics.timing('cursor_execute', start, affected_rows or 0, len(sql))
+        return affected_rows
     finally:
         if cursor:
             cursor.close()
@@ -305,47 +1041,189 @@ def _cursor_execute(sql: str):
 
 def _get_table_cache(table: str):
     stable = cache.get(table)
+    if stable is _TABLE_MISSING:
+        metrics.count('table_cache_hit')
+        return None
     if stable:
+        metrics.count('table_cache_hit')
         return stable
 
-    tables = _select(f"show tables like '{table}'")
+    metrics.count('table_cache_miss')
+    start = metrics.start()
+    tables = _select(f"show tables like '{table}'", 'dict')
+    metrics.timing('meta_lookup', start, 1)
     for tbl in tables:
-        if tbl == table:
+        if tbl['table_name'] == table:
             stable = tbl['stable_name']
-            cache.set(tbl['table_name'], tbl['stable_name'])
+            _set_table_cache(table, stable)
             return stable
 
+    _set_table_missing(table)
     return None
 
 
+def _get_tables_cache(args: list):
+    """
+    stables of the tables of many rows. The tables not cached are looked up with one query per stable given in the
+    rows: select tbname from stable where tbname in (...), the ones not found under it in the other stables by
+    _find_tables, the ones without stable one by one.
+    :param args: [{"table": xxx, ["stable": xxx,] ...}]
+    :return: {table: stable}, stable is None when the table does not exist
+    """
+    stables = {}
+    unknown = {}  # stable -> tables to look up
+    for arg in args:
+        table = arg.get("table")
+        if table is None or table in stables:
+            continue
+        stable = cache.get(table)
+        if stable is _TABLE_MISSING:
+            stables[table] = None
+        elif stable:
+            stables[table] = stable
+        else:
+            stables[table] = None
+            unknown.setdefault(arg.get("stable"), []).append(table)
+    if metrics.enabled:
+        misses = sum(len(tables) for tables in unknown.values())
+        metrics.count('table_cache_hit', len(stables) - misses)
+        metrics.count('table_cache_miss', misses)
+
+    searched = {}  # table not found -> stable it was looked up in
+    for stable, tables in unknown.items():
+        for i in range(0, len(tables), _LOOKUP_BATCH):
+            names = tables[i:i + _LOOKUP_BATCH]
+            try:
+                if stable is None:
+                    raise TDError("no stable to look up by.")
+                names_sql = ','.join(f"'{name}'" for name in names)
+                start = metrics.start()
+                rows = _select(f"select tbname from {stable} where tbname in ({names_sql})", 'dict')
+                metrics.timing('meta_lookup', start, len(names))
+            except (TDError, taos.error.ProgrammingError) as err:
+                logging.debug(f"look up tables of '{stable}' one by one: {err}")
+                for table in names:
+                    stables[table] = _get_table_cache(table)
+                continue
+
+            exist = {row['tbname'] for row in rows}
+            for table in names:
+                if table in exist:
+                    stables[table] = stable
+                    _set_table_cache(table, stable)
+                else:
+                    searched[table] = stable
+    if searched:
+        stables.update(_find_tables(searched))
+    return stables
+
+
+def _find_tables(searched: dict):
+    """
+    stables of the tables not found in the stable they were looked up in: each other stable of the database is
+    looked up once for all of them, or each table is looked up by name when there are fewer tables than stables.
+    The tables found nowhere are remembered as missing.
+    :param searched: {table: stable it is not in}
+    :return: {table: stable}, stable is None when the table does not exist
+    """
+    found = {}
+    remaining = dict(searched)
+    try:
+        start = metrics.start()
+        names = [stbl['name'] for stbl in _select("show stables", 'dict')]
+        metrics.timing('meta_lookup', start)
+        if len(names) - 1 <= len(remaining):
+            for stable in names:
+                tables = [table for table, searched_stable in remaining.items() if searched_stable != stable]
+                for i in range(0, len(tables), _LOOKUP_BATCH):
+                    batch = tables[i:i + _LOOKUP_BATCH]
+                    names_sql = ','.join(f"'{name}'" for name in batch)
+                    start = metrics.start()
+                    rows = _select(f"select tbname from {stable} where tbname in ({names_sql})", 'dict')
+                    metrics.timing('meta_lookup', start, len(batch))
+                    for row in rows:
+                        if remaining.pop(row['tbname'], None) is not None:
+                            found[row['tbname']] = stable
+                            _set_table_cache(row['tbname'], stable)
+                if not remaining:
+                    break
+            for table in remaining:
+                found[table] = None
+                _set_table_missing(table)
+            return found
+    except (TDError, taos.error.ProgrammingError) as err:
+        logging.debug(f"look up tables one by one: {err}")
+    # more stables than tables, or a lookup failed
+    for table in remaining:
+        found[table] = _get_table_cache(table)
+    return found
+
+
+def _set_table_missing(table):
+    global _table_miss_ttl
+    if _table_miss_ttl:
+        cache.set(table, _TABLE_MISSING, _table_miss_ttl)
+
+
 def _del_field_length(f):
-    del f['Length']
+    f.pop('Length', None)
     return f
 
 
 def _get_stable_cache(stable: str):
     desc = cache.get(stable)
     if desc:
+        metrics.count('stable_cache_hit')
         return desc
 
-    stables = _select(f"show stables like '{stable}'")
+    metrics.count('stable_cache_miss')
+    start = metrics.start()
+    stables = _select(f"show stables like '{stable}'", 'dict')
     for stbl in stables:
-        print(stbl, stable)
         if stbl['name'] == stable:
-            fields = _select(f"describe {stable}")
-            fields = [_del_field_length(f) for f in fields]
-            desc = {'columns': stbl['columns'], 'tags': stbl['tags'], 'fields': fields}
-            cache.set(stable, desc)
-            return desc
+            fields = _select(f"describe {stable}", 'dict')
+            metrics.timing('meta_lookup', start, 1)
+            return _set_stable_cache(stbl, fields)
 
     raise TDError(f"Stable' {stable}' does not exist.")
 
 
-def _select(sql: str):
+def _new_stable_desc(stbl, fields):
+    """
+    Stable description kept in cache, the binder is compiled here once and replaced with the description
+    whenever the stable is described again.
+    """
+    global _tz_offset
+    fields = [_del_field_length(f) for f in fields]
+    binder = Binder(_tz_offset, fields)
+    tag_binder = Binder(_tz_offset, fields, 'TAG')
+    return {'columns': stbl['columns'], 'tags': stbl['tags'], 'fields': fields, 'binder': binder,
+            'tag_binder': tag_binder, 'names': (binder.names, tag_binder.names),
+            'value_fields': [f for f in fields if f['Note'] == ""], 'tag_fields': [f for f in fields if f['Note'] == "TAG"]}
+
+
+def _select(sql: str, row_type=None):
     """ execute select SQL and return unique result or list results."""
     result = _query(sql)
     fields = [field['name'] for field in result.fields]
-    return [Dict(fields, x) for x in result]
+    make_row = _row_factory(fields, row_type)
+    return [make_row(x) for x in result]
+
+
+def _row_factory(fields: list, row_type=None):
+    """
+    Return the function that makes a row of row_type from the values of a result row.
+    """
+    global _row_type
+    row_type = row_type or _row_type
+    if row_type == 'dict':
+        return lambda values: Dict(fields, values)
+    elif row_type == 'compact':
+        if ROW_METHODS.isdisjoint(fields):
+            return row_class(tuple(fields))._make
+        return lambda values: Dict(fields, values)
+    else:
+        raise TDError(f"Invalid row_type '{row_type}', expect 'dict' or 'compact'.")
 
 
 def _insert_one(table: str, stable: str, **kwargs):
@@ -355,155 +1233,309 @@ def _insert_one(table: str, stable: str, **kwargs):
     :param kwargs: values: {field: value}, tags are not necessary
     :return: affected_rows
     """
-    global _tz_offset
     desc = _get_stable_cache(stable)
     num_columns = desc['columns']
-    params = bind_params(num_columns, _tz_offset, desc['fields'], **kwargs)
+    params = desc['binder'].bind(kwargs)
     sql = get_insert_sql(table, num_columns)
     logging.debug('SQL: %s' % sql)
     try:
-        return _stmt_execute(sql, params).affected_rows
+        return _stmt_execute(sql, params)
     except taos.error.StatementError as err:
         logging.warning(f"'{table}' {err.msg}")
-        if err.errno == -2147482782:
+        if err.errno == _ERR_TABLE_NOT_EXIST:
+            _forget(table)
             return _insert_one_with_stable(table, stable, num_columns, desc, params, **kwargs)
-        else:
-            raise err
+        elif err.errno == _ERR_SCHEMA_VERSION:
+            _forget(stable)
+            StatementCache.invalidate()
+        raise err
 
 
 def _insert_one_with_stable(table, stable, num_columns, desc, params, **kwargs):
-    tags = [f for f in desc['fields'] if f['Note'] == "TAG"]
+    tags = desc['tag_fields']
     tag_sql_values = get_sql_tags(tags, **kwargs)
     sql = f"INSERT INTO {table} USING {stable} TAGS({tag_sql_values}) VALUES ({','.join(['?' for i in range(num_columns)])})"
     logging.debug('SQL: %s' % sql)
-    result = _stmt_execute(sql, params)
-    cache.set(table, stable)
-    return result.affected_rows
+    affected_rows = _stmt_execute(sql, params)
+    _set_table_cache(table, stable)
+    return affected_rows
 
 
-def _batch_stmt_execute(sql, num_columns, fields, args: list):
-    global _tz_offset
-    params = batch_bind_params(num_columns, _tz_offset, fields, args)
-    return _stmt_execute(sql, params).affected_rows
+def _batch_stmt_execute(sql, binder: Binder, args: list):
+    if not args:
+        return 0
+    if MULTI_BIND:
+        return _stmt_execute(sql, binder.bind_columns(args), multi=True)
+    return _stmt_execute(sql, binder.batch_bind(args))
 
 
 def _insert_many_with_stable(table: str, stable: str, num_columns, desc, args: list):
-    tags = [f for f in desc['fields'] if f['Note'] == "TAG"]
+    tags = desc['tag_fields']
     tag_sql_values = get_sql_tags(tags, **(args[0]))
     sql = f"INSERT INTO {table} USING {stable} TAGS({tag_sql_values}) VALUES ({','.join(['?' for i in range(num_columns)])})"
     logging.debug('SQL: %s' % sql)
-    return _batch_stmt_execute(sql, num_columns, desc['fields'], args)
+    affected_rows = _batch_stmt_execute(sql, desc['binder'], args)
+    _set_table_cache(table, stable)
+    return affected_rows
 
 
 def _insert_many(table: str, stable: str, args: list, batch_size=1000):
-    global _tz_offset
-    desc = _get_stable_cache(stable)
-    num_columns = desc['columns']
-    sql = get_insert_sql(table, num_columns)
-    logging.debug('SQL: %s' % sql)
+    """
+    :return: InsertResult
+    """
+    def insert(rows):
+        desc = _get_stable_cache(stable)
+        num_columns = desc['columns']
+        sql = get_insert_sql(table, num_columns)
+        logging.debug('SQL: %s' % sql)
+        try:
+            return _batch_stmt_execute(sql, desc['binder'], rows)
+        except taos.error.StatementError as err:
+            logging.warning(f"'{table}' {err.msg}")
+            if err.errno == _ERR_TABLE_NOT_EXIST:
+                _forget(table)
+                return _insert_many_with_stable(table, stable, num_columns, desc, rows)
+            elif err.errno == _ERR_SCHEMA_VERSION:
+                _forget(stable)
+                StatementCache.invalidate()
+            raise err
 
-    if args:
-        length = len(args)
-        if length <= batch_size:
-            try:
-                return _batch_stmt_execute(sql, num_columns, desc['fields'], args)
-            except taos.error.StatementError as err:
-                logging.warning(f"'{table}' {err.msg}")
-                if err.errno == -2147482782:
-                    return _insert_many_with_stable(table, stable, num_columns, desc, args)
-                else:
-                    raise err
-        else:
-            affected_rows = 0
-            batches = length // batch_size + 1
-            for i in range(batches):
-                start = i * batch_size
-                end = start + batch_size
-                try:
-                    affected_rows += _batch_stmt_execute(sql, num_columns, desc['fields'], args[start:end])
-                except taos.error.StatementError as err:
-                    logging.warning(f"'{table}' {err.msg}")
-                    if err.errno == -2147482782:
-                        affected_rows += _insert_many_with_stable(table, stable, num_columns, desc, args)
-            return affected_rows
-    else:
-        return 0
+    return _insert_batches(insert, args, batch_size)
 
 
-def _get_sql_with_stable(table, stable, arg):
-    desc = _get_stable_cache(stable)
-    tags = [f for f in desc['fields'] if f['Note'] == "TAG"]
-    tag_sql_values = get_sql_tags(tags, **arg)
-    fields = [f for f in desc['fields'] if f['Note'] == ""]
-    sql_values = get_sql_values(fields, arg)
-    return f"{table} USING {stable} TAGS({tag_sql_values}) VALUES ({sql_values})"
+def _insert_batches(insert, args: list, batch_size, rejected=None):
+    """
+    insert(rows) the args by batches of batch_size rows. A batch that fails is bisected by _insert_rejecting, the
+    rows that cannot be inserted are collected into rejected instead of failing the other rows.
+    :return: InsertResult
+    """
+    rejected = rejected if rejected is not None else []
+    affected_rows = 0
+    for start in range(0, len(args), batch_size):
+        affected_rows += _insert_rejecting(insert, args[start:start + batch_size], rejected)
+    return InsertResult(affected_rows, rejected)
 
 
-def _insert_many_tables_with_stable(args: list):
-    sql_list = ["INSERT INTO"]
+def _insert_rejecting(insert, rows: list, rejected: list):
+    """
+    insert(rows), when it fails the rows are split in halves which are inserted again, recursively, until the rows
+    that fail are isolated and appended to rejected as (row, error). A batch with k bad rows takes about
+    2 * k * log2(len(rows)) more round trips. Connection errors are raised, there is nothing to isolate, and so is
+    the error of a batch whose halves both fail with it: it does not come from the rows.
+    """
+    try:
+        return insert(rows)
+    except Exception as err:
+        if is_connection_error(err):
+            raise err
+        return _bisect(insert, rows, err, rejected)
+
+
+def _bisect(insert, rows: list, err, rejected: list):
+    if len(rows) == 1:
+        logging.error(f"reject row {rows[0]}: {err}")
+        rejected.append((rows[0], err))
+        return 0
+    middle = len(rows) // 2
+    left, right = rows[:middle], rows[middle:]
+    try:
+        left_rows = insert(left)
+    except Exception as left_err:
+        if is_connection_error(left_err):
+            raise left_err
+        try:
+            right_rows = insert(right)
+        except Exception as right_err:
+            if is_connection_error(right_err):
+                raise right_err
+            if _same_error(err, left_err) and _same_error(err, right_err):
+                raise err
+            return _bisect(insert, left, left_err, rejected) + _bisect(insert, right, right_err, rejected)
+        return _bisect(insert, left, left_err, rejected) + right_rows
+    return left_rows + _insert_rejecting(insert, right, rejected)
+
+
+def _same_error(err, other):
+    return type(err) is type(other) and getattr(err, 'errno', None) == getattr(other, 'errno', None) \
+        and str(err) == str(other)
+
+
+def _insert_many_tables(args: list, rejected=None):
+    """
+    insert the rows of many tables by prepared statements: the rows are grouped by stable and by table, all the
+    tables of a stable are bound on one statement with set_tbname, or set_tbname_tags to create them. A stable
+    whose statement fails is inserted again by text SQL.
+    :param rejected: when it is a list, an invalid row is appended to it as (row, error) and the rows of a stable
+                     that fails are bisected by _insert_rejecting, so one stable does not fail the others
+    """
+    global _db_ctx
+    stables = _get_tables_cache(args)
+    groups = {}  # (stable, create) -> {table: [row]}
     for arg in args:
         table = arg.get("table")
         stable = arg.get("stable")
-
         if table is None:
-            raise TDError("'table' is expected.")
-
-        del arg["table"]
-        cache_stable = _get_table_cache(table)
-        if cache_stable:
-            sql_list.append(_get_sql_with_stable(table, cache_stable, arg))
-            if stable:
-                del arg["stable"]
-        elif stable:
-            del arg["stable"]
-            sql_list.append(_get_sql_with_stable(table, cache_stable, arg))
+            err = TDError("'table' is expected.")
         else:
-            raise TDError(f"Table '{table}' does not exits, please add stable")
+            cache_stable = stables.get(table)
+            if cache_stable is None:  # table未创建，需要点指定stable
+                if stable:
+                    groups.setdefault((stable, True), {}).setdefault(table, []).append(arg)
+                    continue
+                err = TDError(f"Table '{table}' does not exits, please add stable")
+            elif stable and cache_stable != stable:
+                err = TDError(f"expect stable '{cache_stable}'，but input '{stable}'.")
+            else:
+                groups.setdefault((cache_stable, False), {}).setdefault(table, []).append(arg)
+                continue
+        if rejected is None:
+            raise err
+        logging.error(f"reject row {arg}: {err}")
+        rejected.append((arg, err))
+
+    affected_rows = 0
+    for (stable, create), tables in groups.items():
+        try:
+            affected_rows += _insert_stable_tables(stable, create, tables)
+        except Exception as err:
+            if rejected is None or is_connection_error(err):
+                raise err
+            rows = [arg for table_rows in tables.values() for arg in table_rows]
+            try:
+                affected_rows += _bisect(_insert_many_tables, rows, err, rejected)
+            except Exception as batch_err:
+                if batch_err is not err:
+                    raise
+                # the stable fails as a whole, its rows are rejected and the other stables go on
+                logging.error(f"reject the {len(rows)} rows of '{stable}': {err}")
+                rejected.extend((arg, err) for arg in rows)
+    return affected_rows
 
-    sql = ' '.join(sql_list)
+
+def _insert_stable_tables(stable, create, tables: dict):
+    """
+    :param tables: {table: [row]} of stable
+    :param create: the tables do not exist
+    """
+    desc = _get_stable_cache(stable)
+    values = ','.join(['?' for _ in range(desc['columns'])])
+    if create:
+        sql = f"INSERT INTO ? USING {stable} TAGS({','.join(['?' for _ in range(desc['tags'])])}) VALUES ({values})"
+    else:
+        sql = f"INSERT INTO ? VALUES ({values})"
     logging.debug('SQL: %s' % sql)
-    return _cursor_execute(sql)
+    try:
+        affected_rows = _stmt_execute_tables(sql, desc, tables, create)
+    except taos.error.StatementError as err:
+        logging.warning(f"'{stable}' {err.msg}, insert {len(tables)} tables by SQL")
+        return _insert_many_tables_sql([arg for rows in tables.values() for arg in rows])
+    if create:
+        for table in tables:
+            _set_table_cache(table, stable)
+    return affected_rows
 
 
-def _insert_many_tables(args: list):
-    args_cp = copy.deepcopy(args)
-    sql_list = ["INSERT INTO"]
+def _stmt_execute_tables(sql, desc, tables: dict, create):
+    """
+    bind the rows of each table on the cached statement of sql and execute them at once,
+    the statement is discarded when it fails.
+    :param tables: {table: [row]}
+    """
+    global _db_ctx
+    binder = desc['binder']
+    stmt = _db_ctx.statement(sql)
+    binds = []  # the bound buffers must live until execute
+    try:
+        for table, rows in tables.items():
+            if create:
+                if not desc['tag_binder'].has_values(rows[0]):
+                    raise TDError(f"参数中没有包含tag，tag字段有：{','.join(desc['tag_binder'].names)}")
+                tags = desc['tag_binder'].bind(rows[0])
+                binds.append(tags)
+                stmt.set_tbname_tags(table, tags)
+            else:
+                stmt.set_tbname(table)
+            if MULTI_BIND:
+                params = binder.bind_columns(rows)
+                binds.append(params)
+                stmt.bind_param_batch(params)
+            else:
+                for params in binder.batch_bind(rows):
+                    binds.append(params)
+                    stmt.bind_param(params)
+        start = metrics.start()
+        stmt.execute()
+        affected_rows = _stmt_affected_rows(stmt)
+        metrics.timing('stmt_execute', start, affected_rows)
+        return affected_rows
+    except Exception:
+        _db_ctx.connection.statements.discard(sql)
+        raise
+
+
+def _insert_many_tables_sql(args: list, known=None):
+    """
+    insert the rows of many tables by text SQL, cut into statements of at most _max_sql_bytes. The rows are neither
+    copied nor modified, the USING clause of a table is built once from its first row.
+    A statement that fails because a table does not exist is executed again: its tables are looked up and only
+    the rows of the missing ones get the USING clause.
+    :param known: {table: stable} of the tables of a failed statement, whose rows may have no stable
+    """
+    global _max_sql_bytes
+    stables = _get_tables_cache(args)
+    builder = SqlBuilder(_max_sql_bytes)
+    descs = {}
+    created = {}
     for arg in args:
         table = arg.get("table")
         stable = arg.get("stable")
-
         if table is None:
             raise TDError("'table' is expected.")
 
-        del arg["table"]
-        cache_stable = _get_table_cache(table)
+        cache_stable = stables.get(table)
         if cache_stable is None:  # table未创建，需要点指定stable
-            if stable:
-                del arg["stable"]
-                sql_list.append(_get_sql_with_stable(table, stable, arg))
-            else:
+            stable = stable or (known and known.get(table))
+            if not stable:
                 raise TDError(f"Table '{table}' does not exits, please add stable")
-        else:  # table已创建， 直接插入VALUES
-            if stable:
-                del arg["stable"]
-                if cache_stable != stable:
-                    raise TDError(f"expect stable '{cache_stable}'，but input '{stable}'.")
-
-            desc = _get_stable_cache(cache_stable)
-            fields = [f for f in desc['fields'] if f['Note'] == ""]
-            sql_values = get_sql_values(fields, arg)
-            sql_list.append(f"{table} VALUES ({sql_values})")
-
-    sql = ' '.join(sql_list)
-    logging.debug('SQL: %s' % sql)
-    try:
-        return _cursor_execute(sql)
-    except taos.error.ProgrammingError as err:
-        logging.warning(f"'{table}' {err.msg}")
-        if err.msg == "Table does not exist":
-            return _insert_many_tables_with_stable(args_cp)
+            created[table] = stable
+        elif stable and cache_stable != stable:
+            raise TDError(f"expect stable '{cache_stable}'，but input '{stable}'.")
         else:
-            raise err
+            stable = cache_stable
+
+        desc = descs.get(stable)
+        if desc is None:
+            desc = descs[stable] = _get_stable_cache(stable)
+        if cache_stable is None:
+            builder.add(table, desc['value_fields'], arg, stable, desc['tag_fields'])
+        else:
+            builder.add(table, desc['value_fields'], arg)
+
+    statements = builder.statements()
+    if known is None:
+        with _sql_stats_lock:
+            _sql_stats['calls'] += 1
+    affected_rows = 0
+    for sql, rows in statements:
+        logging.debug('SQL: %s' % sql)
+        with _sql_stats_lock:
+            _sql_stats['batches'] += 1
+            _sql_stats['bytes'] += len(sql.encode())
+            _sql_stats['rows'] += len(rows)
+        try:
+            affected_rows += _cursor_execute(sql)
+        except taos.error.ProgrammingError as err:
+            logging.warning(f"{len(rows)} rows {err.msg}")
+            if err.msg != "Table does not exist" or known is not None:
+                raise err
+            tables = {arg["table"]: stables.get(arg["table"]) or created.get(arg["table"]) for arg in rows}
+            _forget(list(tables))
+            affected_rows += _insert_many_tables_sql(rows, known=tables)
+            continue
+        for table in {arg["table"] for arg in rows}:
+            if table in created:
+                _set_table_cache(table, created[table])
+    return affected_rows
 
 
 def local_datetime(date_time: datetime, zone_hours=8):
@@ -0,0 +1,400 @@
+import time
+import zlib
+import queue
+import logging
+import threading
+import multiprocessing
+from taostd.model import TDError, InsertResult
+
+
+class BufferedWriter(object):
+    """
+    Collects rows from many threads without blocking and writes them per table in batches from a background thread.
+    A table is written when it has batch_size rows, the other tables every interval seconds.
+    writer = td.BufferedWriter(batch_size=1000, interval=1.0)
+    writer.insert_one('meter_01', ts=datetime.now(), current=0.3550, voltage=0.5542, phase=1)
+    writer.insert_one_with_stable('meter_02', 'meters', ts=datetime.now(), current=0.3550, location='上海', groupId=1)
+    writer.flush()
+    writer.close()
+    """
+
+    def __init__(self, batch_size=1000, interval=1.0, max_pending=100000, timeout=None, callback=None):
+        """
+        :param batch_size: rows of a table that are written at once
+        :param interval: seconds between two writes of the tables that are not full
+        :param max_pending: rows held in memory, including the ones being written. insert_one blocks when it is reached
+        :param timeout: seconds insert_one waits for room, None waits forever. TDError is raised on timeout
+        :param callback: callback(table, rows, affected_rows, error) called after each write, error is None unless
+                         the whole write failed, affected_rows.rejected holds the rows that could not be inserted
+        """
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.callback = callback
+        self.stats = {'rows': 0, 'affected_rows': 0, 'failed_rows': 0, 'writes': 0, 'errors': 0}
+
+        self._cond = threading.Condition()
+        self._tables = {}  # table -> [stable, rows]
+        self._pending = 0
+        self._full = False
+        self._flush_seq = 0
+        self._flushed_seq = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='taostd-writer', daemon=True)
+        self._thread.start()
+
+    def insert_one(self, table: str, **kwargs):
+        """
+        buffer one row of an exit table, like td.insert_one.
+        """
+        self._put(table, None, kwargs)
+
+    def insert_one_with_stable(self, table: str, stable: str, **kwargs):
+        """
+        buffer one row, the table is created when it does not exit, like td.insert_one_with_stable.
+        """
+        self._put(table, stable, kwargs)
+
+    def flush(self):
+        """
+        write all the rows buffered before this call and wait until they are written.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._flush_seq += 1
+            self._wait_flushed(self._flush_seq)
+
+    def close(self):
+        """
+        write all the buffered rows and stop the background thread.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush_seq += 1
+            self._wait_flushed(self._flush_seq)
+        self._thread.join()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.close()
+
+    def _put(self, table, stable, row):
+        with self._cond:
+            if self._closed:
+                raise TDError('BufferedWriter is closed.')
+            if self._pending >= self.max_pending:
+                deadline = None if self.timeout is None else time.monotonic() + self.timeout
+                while self._pending >= self.max_pending:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TDError(f"Write buffer is full, {self._pending} rows are pending.")
+                    self._cond.wait(remaining)
+
+            buffer = self._tables.get(table)
+            if buffer is None:
+                buffer = self._tables[table] = [stable, []]
+            elif stable and buffer[0] is None:
+                buffer[0] = stable
+            buffer[1].append(row)
+            self._pending += 1
+            if len(buffer[1]) >= self.batch_size:
+                self._full = True
+                self._cond.notify_all()
+
+    def _wait_flushed(self, seq):
+        self._cond.notify_all()
+        while self._flushed_seq < seq:
+            self._cond.wait()
+
+    def _run(self):
+        deadline = time.monotonic() + self.interval
+        while True:
+            with self._cond:
+                while not self._full and self._flushed_seq == self._flush_seq:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                seq = self._flush_seq
+                closed = self._closed
+                drain = seq > self._flushed_seq or time.monotonic() >= deadline
+                if drain:
+                    groups = list(self._tables.items())
+                    self._tables = {}
+                    deadline = time.monotonic() + self.interval
+                else:
+                    groups = [(table, buffer) for table, buffer in self._tables.items()
+                              if len(buffer[1]) >= self.batch_size]
+                    for table, _ in groups:
+                        del self._tables[table]
+                self._full = False
+
+            for table, (stable, rows) in groups:
+                self._write(table, stable, rows)
+
+            with self._cond:
+                self._pending -= sum(len(rows) for _, (_, rows) in groups)
+                if drain:
+                    self._flushed_seq = seq
+                self._cond.notify_all()
+            if closed:
+                return
+
+    def _write(self, table, stable, rows):
+        from taostd import td
+
+        affected_rows = InsertResult()
+        error = None
+        try:
+            if stable:
+                affected_rows = td.insert_many_with_stable(table, stable, rows, batch_size=self.batch_size)
+            else:
+                affected_rows = td.insert_many(table, rows, batch_size=self.batch_size)
+        except Exception as err:
+            error = err
+
+        self.stats['writes'] += 1
+        self.stats['rows'] += len(rows)
+        self.stats['affected_rows'] += affected_rows
+        if error is not None:
+            self.stats['errors'] += 1
+            self.stats['failed_rows'] += len(rows)
+        elif affected_rows.rejected:
+            self.stats['errors'] += 1
+            self.stats['failed_rows'] += len(affected_rows.rejected)
+
+        if self.callback:
+            try:
+                self.callback(table, rows, affected_rows, error)
+            except Exception:
+                logging.exception(f"BufferedWriter callback error, table '{table}'.")
+        elif error is not None:
+            logging.error(f"BufferedWriter write {len(rows)} rows into '{table}' error: {error}")
+        elif affected_rows.rejected:
+            logging.error(f"BufferedWriter write {len(affected_rows.rejected)} of {len(rows)} rows into '{table}' "
+                          f"error: {affected_rows.rejected[0][1]}")
+
+
+class ProcessWriter(object):
+    """
+    Inserts rows from worker processes, each one with its own init_db and connection pool, to use more than one core.
+    Rows are routed to a worker by the crc32 of the table name, so the rows of a table keep their order, and sent
+    as column batches of batch_size rows.
+    writer = td.ProcessWriter(4, 'test', pool_size=2, batch_size=5000)
+    writer.insert_one_with_stable('meter_02', 'meters', ts=datetime.now(), current=0.3550, location='上海', groupId=1)
+    writer.insert_many_tables(rows)
+    writer.flush()
+    stats = writer.close()
+    """
+
+    def __init__(self, workers: int, database, *args, batch_size=1000, max_pending_batches=16, mp_context='spawn',
+                 **kwargs):
+        """
+        :param workers: worker processes
+        :param database: args and kwargs: parameters of td.init_db in each worker
+        :param batch_size: rows buffered for a worker before they are sent to it
+        :param max_pending_batches: batches queued to a worker, inserting blocks when it is reached
+        :param mp_context: start method of multiprocessing, 'spawn' does not share the client library state
+        """
+        context = multiprocessing.get_context(mp_context)
+        self.batch_size = batch_size
+        self.stats = {'rows': 0, 'affected_rows': 0, 'failed_rows': 0, 'batches': 0, 'errors': []}
+        self._lock = threading.Lock()
+        self._buffers = [{} for _ in range(workers)]  # table -> [stable, names, {name: index}, columns, rows]
+        self._buffered = [0] * workers
+        self._seq = 0
+        self._closed = False
+        self._results = context.Queue()
+        self._queues = [context.Queue(max_pending_batches) for _ in range(workers)]
+        self._processes = [context.Process(target=_process_worker, name=f'taostd-writer-{i}', daemon=True,
+                                           args=(database, args, kwargs, self._queues[i], self._results))
+                           for i in range(workers)]
+        for process in self._processes:
+            process.start()
+
+    def insert_one(self, table: str, **kwargs):
+        self._put(table, None, [kwargs])
+
+    def insert_one_with_stable(self, table: str, stable: str, **kwargs):
+        self._put(table, stable, [kwargs])
+
+    def insert_many(self, table: str, args: list):
+        self._put(table, None, args)
+
+    def insert_many_with_stable(self, table: str, stable: str, args: list):
+        self._put(table, stable, args)
+
+    def insert_many_tables(self, args: list):
+        """
+        :param args: [{"table": xxx, ["stable": xxx,] “ts”: "2021-01-01 00:22:44.000"...}, {}]
+        """
+        for arg in args:
+            table = arg.get("table")
+            if table is None:
+                raise TDError("'table' is expected.")
+            row = {k: v for k, v in arg.items() if k != "table" and k != "stable"}
+            self._put(table, arg.get("stable"), [row])
+
+    def flush(self):
+        """
+        send the buffered rows and wait until every worker has inserted the rows sent before.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._sync('flush')
+
+    def close(self):
+        """
+        insert the buffered rows, stop the workers and return the stats.
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._sync('close')
+                for process in self._processes:
+                    process.join()
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.close()
+
+    def _put(self, table, stable, rows):
+        i = zlib.crc32(table.encode()) % len(self._queues)
+        with self._lock:
+            if self._closed:
+                raise TDError('ProcessWriter is closed.')
+            buffer = self._buffers[i].get(table)
+            if buffer is None:
+                buffer = self._buffers[i][table] = [stable, [], {}, [], 0]
+            elif stable and buffer[0] is None:
+                buffer[0] = stable
+            _, names, indexes, columns, length = buffer
+            for row in rows:
+                for name, value in row.items():
+                    index = indexes.get(name)
+                    if index is None:
+                        index = indexes[name] = len(names)
+                        names.append(name)
+                        columns.append([None] * length)
+                    columns[index].append(value)
+                length += 1
+                for column in columns:
+                    if len(column) < length:
+                        column.append(None)
+            buffer[4] = length
+            self._buffered[i] += len(rows)
+            if self._buffered[i] >= self.batch_size:
+                self._send(i)
+
+    def _send(self, i):
+        batch = {table: (stable, names, columns) for table, (stable, names, _, columns, _) in self._buffers[i].items()}
+        self._buffers[i] = {}
+        self._buffered[i] = 0
+        self._put_queue(i, ('rows', batch))
+        self.stats['batches'] += 1
+        # the results are polled once per batch sent, not per row
+        self._collect()
+
+    def _put_queue(self, i, message):
+        while True:
+            try:
+                self._queues[i].put(message, timeout=1)
+                return
+            except queue.Full:
+                self._collect()
+                self._check_alive()
+
+    def _sync(self, command):
+        for i in range(len(self._queues)):
+            if self._buffered[i]:
+                self._send(i)
+        self._seq += 1
+        for i in range(len(self._queues)):
+            self._put_queue(i, (command, self._seq))
+        replies = 0
+        while replies < len(self._queues):
+            try:
+                message = self._results.get(timeout=1)
+            except queue.Empty:
+                self._check_alive()
+                continue
+            if self._handle(message) == self._seq:
+                replies += 1
+
+    def _collect(self):
+        while True:
+            try:
+                message = self._results.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(message)
+
+    def _handle(self, message):
+        """
+        :return: seq of a flush or close reply
+        """
+        kind = message[0]
+        if kind == 'result':
+            _, rows, affected_rows = message
+            self.stats['rows'] += rows
+            self.stats['affected_rows'] += affected_rows
+        elif kind == 'error':
+            _, table, rows, error = message
+            self.stats['rows'] += rows
+            self.stats['failed_rows'] += rows
+            self.stats['errors'].append((table, rows, error))
+            logging.error(f"ProcessWriter write {rows} rows into '{table}' error: {error}")
+        elif kind == 'done':
+            return message[1]
+        return None
+
+    def _check_alive(self):
+        for process in self._processes:
+            if not process.is_alive():
+                raise TDError(f"ProcessWriter worker '{process.name}' exited with code {process.exitcode}.")
+
+
+def _process_worker(database, args, kwargs, commands, results):
+    """
+    main of a ProcessWriter worker: insert the column batches and reply to flush and close.
+    """
+    from taostd import td
+
+    td.init_db(database, *args, **kwargs)
+    while True:
+        message = commands.get()
+        kind = message[0]
+        if kind == 'rows':
+            for table, (stable, names, columns) in message[1].items():
+                rows = [dict(zip(names, values)) for values in zip(*columns)]
+                try:
+                    if stable:
+                        affected_rows = td.insert_many_with_stable(table, stable, rows, batch_size=len(rows))
+                    else:
+                        affected_rows = td.insert_many(table, rows, batch_size=len(rows))
+                    rejected = affected_rows.rejected
+                    results.put(('result', len(rows) - len(rejected), int(affected_rows)))
+                    if rejected:
+                        err = rejected[0][1]
+                        results.put(('error', table, len(rejected), f"{type(err).__name__}: {err}"))
+                except Exception as err:
+                    results.put(('error', table, len(rows), f"{type(err).__name__}: {err}"))
+        else:
+            results.put(('done', message[1]))
+            if kind == 'close':
+                return
@@ -0,0 +1,152 @@
+"""
+Tests of the statement cache and the connection pool of taostd.model, run from the repository root:
+    python -m pytest tests
+"""
+import threading
+import time
+
+import pytest
+
+from taostd.model import StatementCache, ConnectionPool, Engine, TDError, PoolTimeoutError
+
+
+class FakeStatement(object):
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeResult(object):
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.prepared = []
+        self.broken = False
+        self.closed = False
+
+    def query(self, sql):
+        if self.broken:
+            raise ConnectionError('connection is broken')
+        return FakeResult()
+
+    def close(self):
+        self.closed = True
+
+    def statement(self, sql):
+        stmt = FakeStatement(sql)
+        self.prepared.append(stmt)
+        return stmt
+
+
+def test_statement_cache_reuses_and_evicts():
+    conn = FakeConnection()
+    statements = StatementCache(2)
+    first = statements.get(conn, 'a')
+    assert statements.get(conn, 'a') is first
+    statements.get(conn, 'b')
+    statements.get(conn, 'c')
+    assert first.closed and len(statements) == 2
+    assert (statements.hits, statements.misses, statements.evictions) == (1, 3, 1)
+
+
+def test_statement_cache_invalidate_closes_the_statements_of_every_cache():
+    conn = FakeConnection()
+    caches = [StatementCache(), StatementCache()]
+    before = [statements.get(conn, 'insert') for statements in caches]
+    StatementCache.invalidate()
+    assert not any(stmt.closed for stmt in before)  # closed on the next use of each cache
+    for statements, stmt in zip(caches, before):
+        again = statements.get(conn, 'insert')
+        assert stmt.closed and again is not stmt
+        assert statements.get(conn, 'insert') is again
+
+
+def test_statement_cache_created_after_invalidate_is_current():
+    conn = FakeConnection()
+    StatementCache.invalidate()
+    statements = StatementCache()
+    stmt = statements.get(conn, 'insert')
+    assert statements.get(conn, 'insert') is stmt and not stmt.closed
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    return ConnectionPool(Engine(connect), **kwargs), opened
+
+
+def test_pool_grows_to_max_size_and_reuses_released_connections():
+    pool, opened = make_pool(min_size=1, max_size=2, timeout=0.05)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second and len(opened) == 2
+    assert pool.stats()['in_use'] == 2
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert pool.stats()['timeouts'] == 1 and len(opened) == 2
+
+
+def test_pool_acquire_waits_for_a_release():
+    pool, _ = make_pool(min_size=1, timeout=5)
+    conn = pool.acquire()
+    releaser = threading.Timer(0.05, pool.release, (conn,))
+    releaser.start()
+    assert pool.acquire() is conn
+    releaser.join()
+    assert pool.stats()['waits'] == 1
+
+
+def test_pool_validates_idle_connections_on_checkout():
+    pool, opened = make_pool(min_size=1, validate_interval=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    opened[0].broken = True
+    assert pool.acquire() is conn
+    assert conn.conn is opened[1] and opened[0].closed
+    assert pool.stats()['validation_failures'] == 1 and pool.stats()['reconnects'] == 1
+
+
+def test_pool_reopens_a_connection_released_as_broken():
+    pool, opened = make_pool(min_size=1, validate_interval=None)
+    conn = pool.acquire()
+    pool.release(conn, broken=True)
+    assert conn.conn is None and opened[0].closed
+    assert pool.acquire() is conn and conn.conn is opened[1]
+
+
+def test_pool_evicts_idle_connections_over_min_size():
+    pool, opened = make_pool(min_size=1, max_size=3, idle_timeout=0.05)
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        pool.release(conn)
+    time.sleep(0.06)
+    pool.release(pool.acquire())
+    stats = pool.stats()
+    assert stats['size'] == 1 and stats['closed'] == 2
+    assert sum(conn.closed for conn in opened) == 2
+
+
+def test_pool_close():
+    pool, opened = make_pool(min_size=2)
+    conn = pool.acquire()
+    pool.close()
+    assert opened[1].closed or opened[0].closed
+    with pytest.raises(TDError):
+        pool.acquire()
+    pool.release(conn)
+    assert all(c.closed for c in opened) and pool.stats()['size'] == 0
@@ -0,0 +1,78 @@
+"""
+Tests of taostd.query_cache, run from the repository root:
+    python -m pytest tests
+"""
+import threading
+
+from taostd.query_cache import QueryCache, normalize, tables_of
+
+
+def test_normalize_keeps_the_quoted_literals():
+    assert normalize("SELECT *  FROM Meters\n WHERE location = 'Bei  Jing';") == \
+        "select * from meters where location = 'Bei  Jing'"
+
+
+def test_tables_of():
+    sql = normalize("select * from test.meters m join `d1` on m.ts = d1.ts where x = 'from other'")
+    assert tables_of(sql) == {'meters', 'd1'}
+
+
+def test_get_caches_until_invalidated():
+    cache = QueryCache()
+    sql = normalize("select last(current) from meters")
+    calls = []
+
+    def query():
+        calls.append(sql)
+        return len(calls)
+
+    assert cache.get(('get', sql), sql, 60, query) == 1
+    assert cache.get(('get', sql), sql, 60, query) == 1
+    cache.invalidate(['d1'])
+    assert cache.get(('get', sql), sql, 60, query) == 1
+    cache.invalidate(['meters'])
+    assert cache.get(('get', sql), sql, 60, query) == 2
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'coalesced': 0, 'invalidations': 1, 'size': 1}
+
+
+def test_concurrent_identical_queries_are_sent_once():
+    cache = QueryCache()
+    sql = normalize("select count(*) from meters")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def query():
+        calls.append(sql)
+        started.set()
+        release.wait(5)
+        return 42
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get(('get', sql), sql, 60, query)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cache.get(('get', sql), sql, 60, query)))
+                 for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while cache.coalesced < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert results == [42] * 4 and len(calls) == 1
+    assert cache.coalesced == 3
+
+
+def test_a_query_invalidated_in_flight_is_not_cached():
+    cache = QueryCache()
+    sql = normalize("select * from meters")
+
+    def query():
+        cache.invalidate(['meters'])
+        return 'stale'
+
+    assert cache.get(('select', sql), sql, 60, query) == 'stale'
+    assert cache.get(('select', sql), sql, 60, lambda: 'fresh') == 'fresh'
+    assert cache.stats()['size'] == 1
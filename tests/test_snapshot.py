@@ -0,0 +1,35 @@
+"""
+Tests of the sqlite meta snapshot of taostd.snapshot, run from the repository root:
+    python -m pytest tests
+"""
+from taostd.snapshot import Snapshot
+
+STABLE = {'name': 'meters', 'columns': 2, 'tags': 2}
+FIELDS = [{'Field': 'ts', 'Type': 'TIMESTAMP', 'Note': ''}, {'Field': 'current', 'Type': 'FLOAT', 'Note': ''}]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'meta.db')
+    snapshot = Snapshot(path, 'test')
+    assert snapshot.reconciled is None
+    snapshot.put_stable(STABLE, FIELDS)
+    snapshot.put_tables([('meter_01', 'meters'), ('meter_02', 'meters')])
+    snapshot.delete(['meter_02'])
+    snapshot.mark_reconciled()
+    snapshot.close()
+
+    snapshot = Snapshot(path, 'test')
+    assert snapshot.load() == ({'meters': (STABLE, FIELDS)}, {'meter_01': 'meters'})
+    assert snapshot.reconciled is not None
+    snapshot.close()
+
+
+def test_snapshot_of_another_database_is_discarded(tmp_path):
+    path = str(tmp_path / 'meta.db')
+    snapshot = Snapshot(path, 'test')
+    snapshot.put_tables([('meter_01', 'meters')])
+    snapshot.close()
+
+    snapshot = Snapshot(path, 'other')
+    assert snapshot.load() == ({}, {})
+    snapshot.close()
@@ -0,0 +1,328 @@
+"""
+Tests of taostd against the fake taos driver of the benchmarks, run from the repository root:
+    python -m pytest tests
+"""
+import os
+import asyncio
+from datetime import datetime
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fake'))
+
+import taos  # noqa: E402  the fake driver
+from taostd import td  # noqa: E402
+from taostd.bind import Binder, to_epoch  # noqa: E402
+from taostd.last_row import LastRowStore  # noqa: E402
+from taostd.model import TDError  # noqa: E402
+from taostd.sql import SqlBuilder  # noqa: E402
+
+FIELDS = [('ts', 'TIMESTAMP', 8, ''), ('current', 'FLOAT', 4, ''), ('location', 'NCHAR', 20, 'TAG'),
+          ('groupid', 'INT', 4, 'TAG')]
+
+
+@pytest.fixture(scope='module', autouse=True)
+def db():
+    taos.SERVER.add_stable('meters', FIELDS)
+    td.init_db('test', warmup='lazy')
+
+
+def test_insert_many_tables_mixed_case_tags():
+    result = td.insert_many_tables([{"table": "case_01", "stable": "meters", "ts": 1, "Current": 0.5,
+                                     "Location": "bj", "groupId": 7}])
+    assert result == 1 and not result.rejected
+    assert taos.SERVER.tags['case_01'] == ['bj', 7]
+
+
+def test_binder_mixed_case_values():
+    desc = td._get_stable_cache('meters')
+    params = desc['binder'].bind({"TS": 1, "Current": 0.5})
+    assert [p.value for p in params] == [1, 0.5]
+    binds = desc['binder'].bind_columns([{"ts": 1, "Current": 0.5}, {"ts": 2, "current": None}])
+    assert binds[1].buffer == [0.5, None]
+
+
+def test_insert_many_tables_without_tags_is_rejected():
+    result = td.insert_many_tables([{"table": "case_02", "stable": "meters", "ts": 1, "current": 0.5}])
+    assert result == 0
+    assert isinstance(result.rejected[0][1], TDError)
+    assert 'case_02' not in taos.SERVER.tables
+
+
+def test_sql_builder_rejects_oversized_row():
+    fields = [{'Field': 'ts', 'Type': 'TIMESTAMP'}, {'Field': 'v', 'Type': 'NCHAR'}]
+    builder = SqlBuilder(100)
+    builder.add('t1', fields, {'ts': 1, 'v': 'a'})
+    with pytest.raises(TDError):
+        builder.add('t1', fields, {'ts': 2, 'v': 'x' * 500})
+    builder.add('t1', fields, {'ts': 3, 'v': 'b'})
+    statements = builder.statements()
+    assert all(len(sql.encode()) <= 100 for sql, _ in statements)
+    assert [row['ts'] for _, rows in statements for row in rows] == [1, 3]
+
+
+def test_insert_many_tables_table_of_another_stable_is_rejected():
+    taos.SERVER.add_stable('sensors', FIELDS)
+    taos.SERVER.tables['sensor_01'] = 'sensors'
+    result = td.insert_many_tables([{"table": "sensor_01", "stable": "meters", "ts": 1, "current": 0.5,
+                                     "location": "bj", "groupid": 7}])
+    assert result == 0
+    assert "expect stable 'sensors'" in str(result.rejected[0][1])
+    assert taos.SERVER.tables['sensor_01'] == 'sensors'
+
+
+def test_parallel_insert_returns_insert_result():
+    rows = [{"table": f"parallel_{n % 3}", "stable": "meters", "ts": n, "current": 0.5, "location": "bj",
+             "groupid": 1} for n in range(9)]
+    rows.append({"table": "parallel_x", "ts": 1, "current": 0.5})
+    result = td.parallel_insert(rows, workers=2)
+    assert result == result.affected_rows == 9
+    assert [row['table'] for row, _ in result.rejected] == ['parallel_x']
+    assert td.parallel_insert([]).rejected == []
+
+
+def test_insert_returns_when_the_last_row_store_fails(monkeypatch):
+    store = LastRowStore(10)
+    store.update([('store_01', 'meters', (['ts', 'current'], ['location', 'groupid']), {'ts': 1, 'current': 0.1})])
+
+    def update(rows):
+        raise ValueError('broken store')
+
+    monkeypatch.setattr(store, 'update', update)
+    monkeypatch.setattr(td, '_last_rows', store)
+    result = td.insert_many_tables([{"table": "store_01", "stable": "meters", "ts": 2, "current": 0.5,
+                                     "location": "bj", "groupid": 1}])
+    assert result == 1
+    assert store.get('store_01') is None
+
+
+def test_select_compact_falls_back_to_dict_on_row_method_names(monkeypatch):
+    monkeypatch.setattr(taos.SERVER, 'select_fields', ['ts', 'values'])
+    monkeypatch.setattr(taos.SERVER, 'select_rows', [(1, 2)])
+    rows = td.select("select ts, `values` from case_01", row_type='compact')
+    assert isinstance(rows[0], dict) and rows[0]['values'] == 2
+    monkeypatch.setattr(taos.SERVER, 'select_fields', ['ts', 'current'])
+    rows = td.select("select ts, current from case_01", row_type='compact')
+    assert isinstance(rows[0], tuple) and rows[0].current == 2
+
+
+def test_to_epoch_honors_the_utc_offset_of_str():
+    local = to_epoch("2024-01-01 08:00:00", 8 * 3600000)
+    assert to_epoch("2024-01-01T00:00:00+00:00", 8 * 3600000) == local
+    assert to_epoch("2024-01-01T00:00:00Z", 8 * 3600000) == local
+    assert to_epoch("2024-01-01 08:00:00.000+0800", 0) == local
+    assert to_epoch("2023-12-31 23:00:00-01:00", 8 * 3600000) == local
+    with pytest.raises(KeyError):
+        to_epoch("2024-01-01 08:00:00+8", 0)
+
+
+def test_last_row_of_mixed_case_keys(monkeypatch):
+    monkeypatch.setattr(td, '_last_rows', LastRowStore(10))
+    td.insert_many_tables([{"table": "mixed_01", "stable": "meters", "TS": 5, "Current": 0.5, "Location": "bj",
+                            "groupid": 1}])
+    assert td.last_row('mixed_01') == {'ts': 5, 'current': 0.5}
+    assert td.stable_last_row('meters', 'location', 'bj') == {'ts': 5, 'current': 0.5}
+
+
+def test_bind_frame_points_into_the_columns_of_a_strided_array():
+    np = pytest.importorskip('numpy')
+    from taostd.frame import frame_columns, bind_frame
+
+    values = np.arange(20, dtype=np.float64).reshape(10, 2)
+    fields = [{'Field': 'ts', 'Type': 'TIMESTAMP', 'Note': ''}, {'Field': 'current', 'Type': 'DOUBLE', 'Note': ''}]
+    columns = frame_columns(fields, {'ts': np.arange(10), 'current': values[:, 1]}, 8)
+    binds = bind_frame(columns, 2, 6)
+    current = columns[1]
+    assert current.data.flags['C_CONTIGUOUS']
+    assert binds[1].buffer.value == current.data.ctypes.data + 2 * current.data.itemsize
+    assert list(current.data[2:6]) == [5.0, 7.0, 9.0, 11.0]
+
+
+def test_aio_calls_release_their_connections(monkeypatch):
+    from taostd import aio
+
+    monkeypatch.setattr(td._pool, 'timeout', 2)
+
+    async def run():
+        monkeypatch.setattr(aio, '_connections', asyncio.Queue())
+        for i in range(2):
+            conn = aio.AsyncConnection(f'taostd-test-{i}')
+            aio._all_connections.append(conn)
+            aio._connections.put_nowait(conn)
+        try:
+            return await asyncio.gather(aio.select("select * from meters"), aio.select("select * from meters"))
+        finally:
+            await aio.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert len(loop.run_until_complete(run())) == 2
+    finally:
+        loop.close()
+    assert td.pool_stats()['in_use'] == 0
+    assert td.select("select * from meters")
+
+
+def test_insert_many_tables_new_tables_are_looked_up_in_batch():
+    rows = [{"table": f"batch_{n}", "stable": "meters", "ts": 1, "current": 0.5, "location": "bj", "groupid": 1}
+            for n in range(50)]
+    taos.SERVER.calls.clear()
+    assert td.insert_many_tables(rows) == 50
+    assert taos.SERVER.calls['query'] <= 1 + len(taos.SERVER.stables)
+
+
+def test_insert_batches_raise_a_batch_error_without_bisecting_it():
+    calls = []
+
+    def insert(rows):
+        calls.append(len(rows))
+        raise TDError("invalid statement")
+
+    with pytest.raises(TDError):
+        td._insert_batches(insert, list(range(100)), 100)
+    assert len(calls) == 3
+
+
+def test_insert_batches_isolate_the_bad_rows():
+    calls = []
+
+    def insert(rows):
+        calls.append(len(rows))
+        if 13 in rows:
+            raise TDError("invalid value")
+        return len(rows)
+
+    result = td._insert_batches(insert, list(range(100)), 100)
+    assert result == 99 and [row for row, _ in result.rejected] == [13]
+    assert len(calls) <= 2 * 7 + 1
+
+
+def test_insert_many_tables_rejects_a_failing_stable_in_three_round_trips(monkeypatch):
+    taos.SERVER.add_stable('sensors', FIELDS)
+    insert_stable_tables = td._insert_stable_tables
+    calls = []
+
+    def failing(stable, create, tables):
+        if stable == 'sensors':
+            calls.append(stable)
+            raise TDError("schema mismatch")
+        return insert_stable_tables(stable, create, tables)
+
+    monkeypatch.setattr(td, '_insert_stable_tables', failing)
+    rows = [{"table": f"sensor_{n}", "stable": "sensors", "ts": 1, "current": 0.5, "location": "bj", "groupid": 1}
+            for n in range(10, 20)]
+    rows.append({"table": "case_01", "ts": 2, "current": 0.5})
+    result = td.insert_many_tables(rows)
+    assert result == 1 and len(result.rejected) == 10
+    assert len(calls) == 3
+
+
+def test_iter_select_shares_its_connection_with_the_calls_of_the_thread(monkeypatch):
+    monkeypatch.setattr(td._pool, 'timeout', 2)
+    monkeypatch.setattr(taos.SERVER, 'select_rows', [(1,), (2,)])
+    for row in td.iter_select("select v from meters"):
+        td.insert_many_tables([{"table": "copy_01", "stable": "meters", "ts": row['v'], "current": 0.5,
+                                "location": "bj", "groupid": 1}])
+    stats = td.pool_stats()
+    assert stats['in_use'] == 0 and stats['size'] == 1
+    rows = td.iter_select("select v from meters")
+    next(rows)
+    assert td.pool_stats()['in_use'] == 1
+    rows.close()
+    assert td.pool_stats()['in_use'] == 0
+
+
+def test_bind_columns_decodes_bytes_of_string_fields():
+    fields = [{'Field': 'ts', 'Type': 'TIMESTAMP', 'Note': ''}, {'Field': 'name', 'Type': 'NCHAR', 'Note': ''},
+              {'Field': 'code', 'Type': 'BINARY', 'Note': ''}]
+    binds = Binder(8, fields).bind_columns([{'ts': 1, 'name': '北京'.encode(), 'code': b'a1'},
+                                            {'ts': 2, 'name': '上海', 'code': None}])
+    assert binds[1].buffer == ['北京', '上海']
+    assert binds[2].buffer == ['a1', None]
+
+
+def test_cached_statement_result_is_closed_before_it_is_executed_again(monkeypatch):
+    results = []
+
+    class Result(object):
+        affected_rows = 1
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def use_result(stmt):
+        assert all(result.closed for result in results)
+        results.append(Result())
+        return results[-1]
+
+    taos.SERVER.tables['stmt_01'] = 'meters'
+    monkeypatch.setattr(taos.TaosStmt, 'use_result', use_result)
+    for ts in (10, 11, 12):
+        assert td.insert_one('stmt_01', ts=ts, current=0.5) == 1
+    assert len(results) == 3 and all(result.closed for result in results)
+
+
+def test_to_lines_timestamp_columns_are_epoch_in_the_precision_of_the_lines():
+    from taostd.lines import to_lines
+
+    stables = {'events': {'ts': ('TIMESTAMP', False), 'seen': ('TIMESTAMP', False), 'v': ('DOUBLE', False)}}
+    row = {'stable': 'events', 'ts': datetime(2024, 1, 1, 8), 'seen': '2024-01-01 08:00:01', 'v': 1}
+    assert to_lines([row], stables, 8, precision='us') == ['events seen=1704067201000000i64,v=1f64 1704067200000000']
+    assert to_lines([{'stable': 'events', 'ts': 1, 'at': datetime(2024, 1, 1, 8)}], {}, 8) == \
+        ['events at=1704067200000i64 1']
+
+
+def test_select_cache_is_invalidated_by_an_insert(monkeypatch):
+    taos.SERVER.tables['cached_01'] = 'meters'
+    monkeypatch.setattr(taos.SERVER, 'select_fields', ['v'])
+    monkeypatch.setattr(taos.SERVER, 'select_rows', [(1,)])
+    assert td.get("select last(current) from cached_01", ttl=60) == 1
+    monkeypatch.setattr(taos.SERVER, 'select_rows', [(2,)])
+    assert td.get("select last(current) from cached_01", ttl=60) == 1
+    td.insert_one('cached_01', ts=1, current=0.5)
+    assert td.get("select last(current) from cached_01", ttl=60) == 2
+
+
+def test_metrics_registry_records_the_inserts():
+    from taostd import metrics
+
+    taos.SERVER.tables['metered_01'] = 'meters'
+    registry = metrics.enable()
+    try:
+        td.insert_many('metered_01', [{"ts": n, "current": 0.5} for n in range(10)])
+        td.insert_many('metered_01', [{"ts": n, "current": 0.5} for n in range(10, 15)])
+    finally:
+        metrics.disable()
+    timings, counters = registry.snapshot()
+    assert timings['stmt_execute']['count'] == 2 and timings['stmt_execute']['rows'] == 15
+    assert counters['table_cache_hit'] >= 1
+    assert 'taostd_stmt_execute_seconds_count 2' in registry.dump()
+
+
+def test_buffered_writer_writes_per_table():
+    taos.SERVER.tables['buffered_01'] = 'meters'
+    written = []
+    writer = td.BufferedWriter(batch_size=5, interval=60, callback=lambda *args: written.append(args))
+    for n in range(7):
+        writer.insert_one('buffered_01', ts=n, current=0.5)
+    writer.insert_one_with_stable('buffered_02', 'meters', ts=1, current=0.5, location='bj', groupid=1)
+    writer.flush()
+    writer.close()
+    assert writer.stats['rows'] == 8 and writer.stats['affected_rows'] == 8 and writer.stats['errors'] == 0
+    tables = {}
+    for table, rows, affected_rows, error in written:
+        assert error is None and affected_rows == len(rows)
+        tables[table] = tables.get(table, 0) + len(rows)
+    assert tables == {'buffered_01': 7, 'buffered_02': 1}
+
+
+def test_str2time():
+    from datetime import timezone, timedelta
+    from taostd.bind import str2time
+
+    assert str2time("2024-01-01 08:00:00.5") == datetime(2024, 1, 1, 8, 0, 0, 500000)
+    assert str2time("2024-01-01 08") == datetime(2024, 1, 1, 8)
+    assert str2time("2024-01-01T08:00:00+08:00") == datetime(2024, 1, 1, 8, tzinfo=timezone(timedelta(hours=8)))
+    assert str2time("2024-01-01T00:00:00Z") == datetime(2024, 1, 1, tzinfo=timezone.utc)